@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+
+from os import path
+
+import archive
+
+
+class PairAggregate:
+    # running report values of one pair, offsets are bytes of spread and
+    # trades files already accounted for
+    def __init__(self):
+        self.spread_sum = 0.0
+        self.spread_count = 0
+        self.trade_count = 0
+        self.volume_btc = 0.0
+        self.total_time = 0.0
+        self.session_start = None
+        self.session_end = None
+        self.offsets = {'spread': 0, 'trades': 0}
+
+    def add_spread(self, ask, bid):
+        self.spread_sum += (ask - bid) / ask
+        self.spread_count += 1
+
+    def add_trade(self, timestamp, amount_btc, new_session):
+        if new_session or self.session_start is None:
+            if self.session_start is not None:
+                self.total_time += (self.session_end - self.session_start) / 1000
+            self.session_start = timestamp
+        self.session_end = timestamp
+        self.trade_count += 1
+        self.volume_btc += amount_btc
+
+    def spread(self):
+        if self.spread_count == 0:
+            return 0.0
+        return self.spread_sum / self.spread_count
+
+    def session_time(self):
+        # seconds covered by trade sessions, sessions are split at break=True
+        if self.session_start is None:
+            return self.total_time
+        return self.total_time + (self.session_end - self.session_start) / 1000
+
+    def merge(self, other):
+        # sessions of different files never continue each other
+        self.spread_sum += other.spread_sum
+        self.spread_count += other.spread_count
+        self.trade_count += other.trade_count
+        self.volume_btc += other.volume_btc
+        self.total_time = self.session_time() + other.session_time()
+        self.session_start = None
+        self.session_end = None
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @staticmethod
+    def from_dict(data):
+        aggregate = PairAggregate()
+        aggregate.__dict__.update(data)
+        return aggregate
+
+
+class AggregateStore:
+    # collector worker processes keep their own aggregates.<worker>.json,
+    # load() reads all of them
+    FILE = 'aggregates.json'
+
+    def __init__(self, root, worker=None):
+        self.root = root
+        name = self.FILE if worker is None else 'aggregates.{}.json'.format(worker)
+        self.file_path = path.join(root, name)
+        self.pairs = {}
+        self.lock = threading.Lock()
+
+    def get(self, exchange_name, pair):
+        with self.lock:
+            if (exchange_name, pair) not in self.pairs:
+                self.pairs[(exchange_name, pair)] = PairAggregate()
+            return self.pairs[(exchange_name, pair)]
+
+    def load(self, pairs=None):
+        # pair moved between workers is in several files, the record that
+        # accounts for most of its files wins
+        for name in archive.list_files(self.root):
+            if not (name == self.FILE or (name.startswith('aggregates.') and name.endswith('.json'))):
+                continue
+            try:
+                with archive.open_file(path.join(self.root, name), 'r') as f:
+                    records = json.load(f)
+            except FileNotFoundError:
+                continue
+            for record in records:
+                key = (record.pop('exchange'), record.pop('pair'))
+                if pairs is not None and key not in pairs:
+                    continue
+                aggregate = PairAggregate.from_dict(record)
+                current = self.pairs.get(key)
+                if current is None or progress(aggregate) > progress(current):
+                    self.pairs[key] = aggregate
+
+    def save(self):
+        with self.lock:
+            records = [
+                dict(a.to_dict(), exchange=key[0], pair=key[1])
+                for key, a in self.pairs.items()
+            ]
+        tmp = self.file_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(records, f)
+        os.replace(tmp, self.file_path)
+
+    def checkpoint(self, file_path):
+        # called once all written rows are flushed and added to aggregates
+        with self.lock:
+            for (exchange_name, pair), aggregate in self.pairs.items():
+                for kind in aggregate.offsets:
+                    aggregate.offsets[kind] = file_size(file_path((kind, exchange_name, pair)))
+        self.save()
+
+    def catch_up(self, exchange_name, pair, file_path):
+        # add rows written after the last checkpoint
+        aggregate = self.get(exchange_name, pair)
+        for data in read_rows(file_path(('spread', exchange_name, pair)), aggregate.offsets, 'spread'):
+            _, ask, bid = data
+            aggregate.add_spread(float(ask), float(bid))
+        for data in read_rows(file_path(('trades', exchange_name, pair)), aggregate.offsets, 'trades'):
+            _, timestamp, _, side, price, amount, br, amount_btc = data
+            aggregate.add_trade(int(timestamp), float(amount_btc), br == 'break=True')
+        return aggregate
+
+
+def progress(aggregate):
+    return aggregate.offsets['spread'] + aggregate.offsets['trades']
+
+
+def file_size(file_path):
+    try:
+        return path.getsize(file_path)
+    except FileNotFoundError:
+        return 0
+
+
+def read_rows(file_path, offsets, kind):
+    # complete csv rows after offsets[kind], offset is moved past every yielded row
+    try:
+        f = archive.open_file(file_path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offsets[kind])
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offsets[kind] += len(line)
+            yield tuple(s.strip() for s in line.decode('utf-8').split(','))
@@ -0,0 +1,193 @@
+import io
+import json
+import os
+import shutil
+import struct
+import zlib
+
+from os import path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# <day>.pack layout: MAGIC, compressed frame of every file, json table of
+# contents, TRAILER (toc offset, MAGIC)
+MAGIC = b'CSPACK1\n'
+TRAILER = struct.Struct('<q8s')
+SUFFIX = '.pack'
+CHUNK = 1 << 20
+
+
+def archive_path(day_root):
+    return path.normpath(day_root) + SUFFIX
+
+
+def is_archived(day_root):
+    return not path.isdir(day_root) and path.isfile(archive_path(day_root))
+
+
+def day_exists(day_root):
+    return path.isdir(day_root) or path.isfile(archive_path(day_root))
+
+
+def list_files(day_root):
+    if path.isdir(day_root):
+        return sorted(os.listdir(day_root))
+    if is_archived(day_root):
+        return sorted(Archive(archive_path(day_root)).toc)
+    return []
+
+
+def file_exists(file_path):
+    day_root, name = path.split(file_path)
+    if path.exists(file_path):
+        return True
+    return is_archived(day_root) and name in Archive(archive_path(day_root)).toc
+
+
+def compressor(codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    return zlib.compressobj(wbits=31)
+
+
+def decompressor(codec):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(wbits=31)
+
+
+def pack_day(day_root, remove=True):
+    # pack all files of day directory into one archive, originals are removed
+    # only after the archive is written and verified
+    codec = 'zstd' if zstandard is not None else 'gzip'
+    target = archive_path(day_root)
+    tmp = target + '.tmp'
+    toc = {}
+    with open(tmp, 'wb') as out:
+        out.write(MAGIC)
+        for name in sorted(os.listdir(day_root)):
+            file_path = path.join(day_root, name)
+            if not path.isfile(file_path):
+                continue
+            offset = out.tell()
+            size = 0
+            c = compressor(codec)
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK), b''):
+                    size += len(chunk)
+                    out.write(c.compress(chunk))
+            out.write(c.flush())
+            toc[name] = {'offset': offset, 'length': out.tell() - offset, 'size': size, 'codec': codec}
+        toc_offset = out.tell()
+        out.write(json.dumps(toc).encode('utf-8'))
+        out.write(TRAILER.pack(toc_offset, MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+    archive = Archive(tmp)
+    for name, entry in toc.items():
+        with archive.open(name, 'rb') as f:
+            size = sum(len(chunk) for chunk in iter(lambda: f.read(CHUNK), b''))
+        if size != entry['size']:
+            raise Exception("Archive verification failed: {} in {}".format(name, tmp))
+    os.replace(tmp, target)
+    if remove:
+        shutil.rmtree(day_root)
+    return target
+
+
+class Archive:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            f.seek(-TRAILER.size, os.SEEK_END)
+            end = f.tell()
+            toc_offset, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != MAGIC:
+                raise Exception("Not an archive: {}".format(file_path))
+            f.seek(toc_offset)
+            self.toc = json.loads(f.read(end - toc_offset).decode('utf-8'))
+
+    def names(self):
+        return list(self.toc)
+
+    def open(self, name, mode='r'):
+        raw = ArchiveMember(self.file_path, self.toc[name])
+        f = io.BufferedReader(raw, CHUNK)
+        if 'b' in mode:
+            return f
+        return io.TextIOWrapper(f, encoding='utf-8')
+
+
+class ArchiveMember(io.RawIOBase):
+    # decompressing stream of one file, supports forward seeks only by
+    # decompressing up to the target (seek to end or before start is free)
+    def __init__(self, file_path, entry):
+        self.file = open(file_path, 'rb')
+        self.entry = entry
+        self.restart()
+
+    def restart(self):
+        self.file.seek(self.entry['offset'])
+        self.remaining = self.entry['length']
+        self.decompressor = decompressor(self.entry['codec'])
+        self.pending = b''
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.entry['size']
+        offset = min(offset, self.entry['size'])
+        if offset < self.position:
+            self.restart()
+        if offset == self.entry['size']:
+            self.remaining = 0
+            self.pending = b''
+            self.position = offset
+        while self.position < offset:
+            if not self.read(min(CHUNK, offset - self.position)):
+                break
+        return self.position
+
+    def readinto(self, buffer):
+        while not self.pending and self.remaining > 0:
+            data = self.file.read(min(CHUNK, self.remaining))
+            if not data:
+                break
+            self.remaining -= len(data)
+            self.pending = self.decompressor.decompress(data)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        self.position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
+
+
+def open_file(file_path, mode='r'):
+    # open file of day directory, from <day>.pack when day is archived
+    day_root, name = path.split(file_path)
+    if not path.exists(file_path) and is_archived(day_root):
+        archive = Archive(archive_path(day_root))
+        if name not in archive.toc:
+            raise FileNotFoundError(file_path)
+        return archive.open(name, mode)
+    return open(file_path, mode)
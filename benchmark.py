@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+# offline benchmarks on fake_exchange.FakeExchange, results are written as json
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from os import path
+from datetime import datetime, timedelta
+
+import exchange
+from collector import Collector, generic_file_path
+from fake_exchange import FakeExchange
+
+
+def register(name, requests_per_second=None, **kwargs):
+    # make `name` resolvable by exchange.api_by_name / shared_api
+    exchange.FAKE_EXCHANGES[name] = lambda: FakeExchange(id=name, **kwargs)
+    exchange._shared_apis.pop(name, None)
+    if requests_per_second is not None:
+        exchange.REQUESTS_PER_SECOND[name] = requests_per_second
+    return name
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def measure(function, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def result(name, params, runs):
+    print("{} {}: best={:.4f}s mean={:.4f}s".format(name, params, min(runs), sum(runs) / len(runs)), file=sys.stderr)
+    return {
+        'name': name,
+        'params': params,
+        'runs': runs,
+        'best': min(runs),
+        'mean': sum(runs) / len(runs),
+    }
+
+
+def bench_pair_graph(args):
+    results = []
+    for currencies in args.currencies:
+        api = FakeExchange(currencies=currencies, seed=args.seed)
+        graphs = []
+        runs = measure(lambda: graphs.append(exchange.PairGraph(api)), args.repeat)
+        params = {'currencies': currencies, 'markets': len(api.markets)}
+        results.append(result('pair_graph.build', params, runs))
+        # trees are built lazily on first use, so each run takes a fresh graph
+        fresh = list(graphs)
+
+        def build_tree():
+            graph = fresh.pop()
+            graph.tree(graph.indexes['BTC'])
+
+        runs = measure(build_tree, args.repeat)
+        results.append(result('pair_graph.tree', params, runs))
+        graph = graphs[-1]
+        runs = measure(lambda: graph.update_valuation('BTC'), args.repeat)
+        results.append(result('pair_graph.update_valuation', params, runs))
+    return results
+
+
+def bench_get_suitable_pairs(args, root):
+    results = []
+    for currencies in args.currencies:
+        name = register('fake_pairs_{}'.format(currencies), requests_per_second=args.requests_per_second,
+                        currencies=currencies, latency=args.latency, seed=args.seed)
+        with quiet():
+            c = Collector(path.join(root, 'pairs_{}'.format(currencies)), pairs=[])
+            c.EXCHANGES = (name,)
+            c.get_graph(name)
+            runs = measure(c.get_suitable_pairs, args.repeat)
+            c.close()
+        params = {'currencies': currencies, 'markets': len(c.graphs[name].markets)}
+        results.append(result('collector.get_suitable_pairs', params, runs))
+    return results
+
+
+def bench_collect(args, root):
+    results = []
+    for pair_count in args.pairs:
+        name = register('fake_collect_{}'.format(pair_count), requests_per_second=args.requests_per_second,
+                        currencies=max(50, pair_count), depth=args.depth, trade_rate=args.trade_rate,
+                        latency=args.latency, seed=args.seed)
+        api = exchange.api_by_name(name)
+        pairs = [(name, m['symbol']) for m in api.markets[:pair_count]]
+        with quiet():
+            c = Collector(path.join(root, 'collect_{}'.format(pair_count)), pairs=pairs)
+            # first cycle builds graph and valuation tree
+            c.collect()
+            runs = measure(c.collect, args.repeat)
+            c.close()
+        params = {
+            'pairs': len(pairs), 'workers': Collector.WORKERS, 'depth': args.depth,
+            'trade_rate': args.trade_rate, 'latency': args.latency, 'book_storage': Collector.BOOK_STORAGE,
+        }
+        results.append(result('collector.collect', params, runs))
+    return results
+
+
+def write_day(day_root, pairs, rows, seed=0):
+    # day directory as written by Collector with `rows` spread and trade rows per pair
+    rnd = random.Random(seed)
+    os.makedirs(day_root)
+    start = datetime(2018, 1, 1)
+    with open(path.join(day_root, 'pairs.csv'), 'w') as f:
+        for exchange_name, pair in pairs:
+            f.write("{}, {}, {}, 1.0, 1000.0, 50.0\n".format(start, exchange_name, pair))
+    for exchange_name, pair in pairs:
+        with open(generic_file_path(day_root, ('spread', exchange_name, pair)), 'w') as f:
+            for i in range(rows):
+                bid = rnd.uniform(0.9, 1.1)
+                f.write("{}, {}, {}\n".format(start + timedelta(seconds=i), bid * rnd.uniform(1.001, 1.02), bid))
+        with open(generic_file_path(day_root, ('trades', exchange_name, pair)), 'w') as f:
+            timestamp = int(start.timestamp() * 1000)
+            for i in range(rows):
+                timestamp += rnd.randint(100, 5000)
+                side = rnd.choice(('buy', 'sell'))
+                f.write("{}, {}, {}, {}, {}, {}, break={}, {}\n".format(
+                    start + timedelta(seconds=i), timestamp, i, side, rnd.uniform(0.9, 1.1),
+                    rnd.uniform(0.1, 10), i % 100 == 0, rnd.uniform(0.001, 0.1)))
+
+
+def bench_generate_report(args, root):
+    from bot import ReportCollector
+    results = []
+    pairs = [('fake', 'C{}/BTC'.format(i)) for i in range(args.report_pairs)]
+    for rows in args.rows:
+        day_root = path.join(root, 'report_{}'.format(rows))
+        write_day(day_root, pairs, rows, args.seed)
+        sidecar = path.join(day_root, 'aggregates.json')
+
+        def report(cold):
+            if cold and path.exists(sidecar):
+                os.remove(sidecar)
+            c = ReportCollector(day_root)
+            c.generate_report()
+            c.aggregates.save()
+            c.close()
+
+        params = {'pairs': len(pairs), 'rows': rows}
+        with quiet():
+            runs = measure(lambda: report(True), args.repeat)
+        results.append(result('report_collector.generate_report.cold', params, runs))
+        with quiet():
+            runs = measure(lambda: report(False), args.repeat)
+        results.append(result('report_collector.generate_report.warm', params, runs))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+BENCHMARKS = ('pair_graph', 'get_suitable_pairs', 'collect', 'generate_report')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run offline benchmarks against simulated exchange')
+    parser.add_argument("-b", "--benchmark", action="append", choices=BENCHMARKS, help="Benchmark to run, all by default")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="Json file with results")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("--currencies", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--pairs", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--report-pairs", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=100, help="Order book levels per side")
+    parser.add_argument("--trade-rate", type=float, default=1.0, help="Trades per second of every pair")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--requests-per-second", type=float, default=1e6, help="Throttling of fake exchange")
+    parser.add_argument("-j", "--jobs", type=int, default=Collector.WORKERS)
+    parser.add_argument("--book-storage", default=Collector.BOOK_STORAGE)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    Collector.WORKERS = args.jobs
+    Collector.BOOK_STORAGE = args.book_storage
+    selected = args.benchmark or BENCHMARKS
+
+    root = tempfile.mkdtemp(prefix='cryptostats_bench_')
+    results = []
+    try:
+        if 'pair_graph' in selected:
+            results += bench_pair_graph(args)
+        if 'get_suitable_pairs' in selected:
+            results += bench_get_suitable_pairs(args, root)
+        if 'collect' in selected:
+            results += bench_collect(args, root)
+        if 'generate_report' in selected:
+            results += bench_generate_report(args, root)
+    finally:
+        shutil.rmtree(root)
+
+    report = {
+        'time': time.time(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("Results written to", args.output, file=sys.stderr)
@@ -0,0 +1,210 @@
+import os
+import struct
+import sys
+
+from array import array
+
+import archive
+
+
+# per snapshot header: time, iteration, ask levels, bid levels, offset of first level
+HEADER = struct.Struct('<dqiiq')
+HEADER_DTYPE = [('time', '<f8'), ('iteration', '<i8'), ('asks', '<i4'), ('bids', '<i4'), ('offset', '<i8')]
+# delta snapshots add keyframe flag, levels of non keyframes are changes to previous book
+DELTA_HEADER = struct.Struct('<dqiiqi4x')
+DELTA_HEADER_DTYPE = HEADER_DTYPE + [('keyframe', '<i4'), ('padding', 'V4')]
+KEYFRAME_INTERVAL = 50
+
+
+class BinaryBookStore:
+    # Order book snapshots as column files next to the csv ones:
+    #   <name>.head   - HEADER per snapshot
+    #   <name>.price  - float64 price of every level, asks then bids
+    #   <name>.amount - float64 amount of every level
+    def __init__(self, writer):
+        self.writer = writer
+        self.offsets = {}
+
+    def offset(self, base_path):
+        if base_path not in self.offsets:
+            try:
+                self.offsets[base_path] = os.path.getsize(base_path + '.price') // 8
+            except FileNotFoundError:
+                self.offsets[base_path] = 0
+        return self.offsets[base_path]
+
+    def append(self, base_path, timestamp, iteration, asks, bids):
+        offset = self.write_levels(base_path, list(asks) + list(bids))
+        self.writer.write(base_path + '.head', HEADER.pack(timestamp, iteration, len(asks), len(bids), offset))
+
+    def write_levels(self, base_path, levels):
+        offset = self.offset(base_path)
+        prices = array('d', (l[0] for l in levels))
+        amounts = array('d', (l[1] for l in levels))
+        if sys.byteorder == 'big':
+            prices.byteswap()
+            amounts.byteswap()
+        self.writer.write(base_path + '.price', prices.tobytes())
+        self.writer.write(base_path + '.amount', amounts.tobytes())
+        self.offsets[base_path] = offset + len(levels)
+        return offset
+
+
+class DeltaBookStore(BinaryBookStore):
+    # Same columns under <name>.delta.*, a full book is stored every
+    # keyframe_interval snapshots and only changed levels in between.
+    # Removed level is stored with zero amount.
+    def __init__(self, writer, keyframe_interval=KEYFRAME_INTERVAL):
+        super().__init__(writer)
+        self.keyframe_interval = keyframe_interval
+        self.books = {}
+
+    def append(self, base_path, timestamp, iteration, asks, bids):
+        base_path += '.delta'
+        asks = {price: amount for price, amount in asks}
+        bids = {price: amount for price, amount in bids}
+        previous = self.books.get(base_path)
+        if previous is None or previous[0] >= self.keyframe_interval:
+            since_keyframe = 1
+            keyframe = True
+            ask_levels = list(asks.items())
+            bid_levels = list(bids.items())
+        else:
+            since_keyframe = previous[0] + 1
+            keyframe = False
+            ask_levels = book_delta(previous[1], asks)
+            bid_levels = book_delta(previous[2], bids)
+        self.books[base_path] = (since_keyframe, asks, bids)
+        offset = self.write_levels(base_path, ask_levels + bid_levels)
+        header = DELTA_HEADER.pack(timestamp, iteration, len(ask_levels), len(bid_levels), offset, keyframe)
+        self.writer.write(base_path + '.head', header)
+
+
+def book_delta(old, new):
+    changes = [(price, amount) for price, amount in new.items() if old.get(price) != amount]
+    changes += [(price, 0.0) for price in old if price not in new]
+    return changes
+
+
+STORES = {
+    'binary': BinaryBookStore,
+    'delta': DeltaBookStore,
+}
+
+
+class BookHistory:
+    def __init__(self, headers, prices, amounts):
+        self.headers = headers
+        self.prices = prices
+        self.amounts = amounts
+
+    def __len__(self):
+        return len(self.headers)
+
+    def snapshot(self, i):
+        # (prices, amounts) of asks and bids of i-th snapshot as array views
+        h = self.headers[i]
+        start = int(h['offset'])
+        middle = start + int(h['asks'])
+        end = middle + int(h['bids'])
+        asks = (self.prices[start:middle], self.amounts[start:middle])
+        bids = (self.prices[middle:end], self.amounts[middle:end])
+        return asks, bids
+
+    def books(self, start=0):
+        # (index, asks, bids) of every snapshot from start as lists of [price, amount]
+        for i in range(start, len(self)):
+            (ask_prices, ask_amounts), (bid_prices, bid_amounts) = self.snapshot(i)
+            asks = [list(l) for l in zip(ask_prices.tolist(), ask_amounts.tolist())]
+            bids = [list(l) for l in zip(bid_prices.tolist(), bid_amounts.tolist())]
+            yield i, asks, bids
+
+
+class DeltaBookHistory(BookHistory):
+    def __init__(self, headers, prices, amounts):
+        super().__init__(headers, prices, amounts)
+        self.keyframes = headers['keyframe'].nonzero()[0]
+
+    def index_at_time(self, timestamp):
+        # last snapshot taken at or before timestamp
+        return int(self.headers['time'].searchsorted(timestamp, 'right')) - 1
+
+    def index_of_iteration(self, iteration):
+        found = (self.headers['iteration'] == iteration).nonzero()[0]
+        if len(found) == 0:
+            raise KeyError(iteration)
+        return int(found[-1])
+
+    def keyframe_before(self, i):
+        return int(self.keyframes[self.keyframes.searchsorted(i, 'right') - 1])
+
+    def apply(self, i, asks, bids):
+        # update asks and bids dicts with levels of i-th snapshot
+        if self.headers['keyframe'][i]:
+            asks.clear()
+            bids.clear()
+        (ask_prices, ask_amounts), (bid_prices, bid_amounts) = self.snapshot(i)
+        for side, prices, amounts in ((asks, ask_prices, ask_amounts), (bids, bid_prices, bid_amounts)):
+            for price, amount in zip(prices.tolist(), amounts.tolist()):
+                if amount == 0:
+                    side.pop(price, None)
+                else:
+                    side[price] = amount
+
+    def book(self, i):
+        # full book of i-th snapshot replayed from the nearest keyframe,
+        # asks ascending and bids descending lists of [price, amount]
+        asks = {}
+        bids = {}
+        for j in range(self.keyframe_before(i), i + 1):
+            self.apply(j, asks, bids)
+        return sorted_levels(asks, bids)
+
+    def books(self, start=0):
+        # full books from start, deltas are applied once instead of per snapshot
+        if start >= len(self):
+            return
+        asks = {}
+        bids = {}
+        for j in range(self.keyframe_before(start), len(self)):
+            self.apply(j, asks, bids)
+            if j >= start:
+                yield (j,) + sorted_levels(asks, bids)
+
+    def book_at(self, iteration):
+        return self.book(self.index_of_iteration(iteration))
+
+
+def sorted_levels(asks, bids):
+    return (
+        [[p, asks[p]] for p in sorted(asks)],
+        [[p, bids[p]] for p in sorted(bids, reverse=True)],
+    )
+
+
+def load_books(base_path):
+    return BookHistory(*load_columns(base_path, HEADER_DTYPE))
+
+
+def load_delta_books(base_path):
+    return DeltaBookHistory(*load_columns(base_path + '.delta', DELTA_HEADER_DTYPE))
+
+
+def load_columns(base_path, header_dtype):
+    import numpy as np
+
+    def column(suffix, dtype):
+        file_path = base_path + suffix
+        if not os.path.exists(file_path):
+            # archived day, no memory mapping of compressed data
+            with archive.open_file(file_path, 'rb') as f:
+                return np.frombuffer(f.read(), dtype=dtype)
+        if os.path.getsize(file_path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode='r')
+
+    return (
+        column('.head', np.dtype(header_dtype)),
+        column('.price', np.dtype('<f8')),
+        column('.amount', np.dtype('<f8')),
+    )
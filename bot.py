@@ -1,13 +1,18 @@
 #!/usr/bin/python3
-import pickle
 import time
 import datetime
 import os
 import traceback
+import asyncio
 from os import path
-from RepeatedTimer import RepeatedTimer
-from collector import Collector, CollectorManager
-import subprocess
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collector import Collector, CollectorManager, generic_file_path
+from aggregates import AggregateStore, PairAggregate
+import archive
+import loader
+import livestate
+import metrics
 
 import sys
 import discord
@@ -22,22 +27,97 @@ def print(*args):
         pass
 
 
+def read_pair_volumes(file_path):
+    pair_volumes = {}
+    with archive.open_file(file_path, 'r') as f:
+        for l in f:
+            args = [x.strip() for x in l.split(',')]
+            pair_volumes[(args[1], args[2])] = float(args[5])
+    return pair_volumes
+
+
+def day_pair_aggregate(root, exchange_name, pair, aggregate):
+    # runs in worker process of ReportManager.report_range, aggregate is the
+    # pair's record of day sidecar loaded once by the caller
+    store = AggregateStore(root)
+    store.pairs[(exchange_name, pair)] = aggregate
+    return loader.catch_up(store, exchange_name, pair, partial(generic_file_path, root))
+
+
+def format_stats(snapshot, top=10):
+    lines = ["metrics at {}".format(datetime.datetime.fromtimestamp(snapshot['time']))]
+    scheduler = snapshot['gauges'].get('scheduler')
+    if scheduler and scheduler['duration']:
+        lines.append("cycle: last={last:.1f}s mean={mean:.1f}s max={max:.1f}s".format(**scheduler['duration'])
+            + " interval={interval}s runs={runs} skipped={skipped}".format(**scheduler)
+            + " errors={}".format(scheduler.get('errors', 0)))
+    for name, h in sorted(snapshot['histograms'].items()):
+        if 'mean' in h:
+            lines.append("{}: n={count} mean={mean:.3f}s p90={p90:.3f}s max={max:.3f}s".format(name, **h))
+    written = [(v, k[len('bytes.'):]) for k, v in snapshot['counters'].items() if k.startswith('bytes.')]
+    for size, name in sorted(written, reverse=True)[:top]:
+        rows = snapshot['counters'].get('rows.' + name, 0)
+        lines.append("{}: rows={} bytes={}".format(name, rows, size))
+    return "\n".join(lines)
+
+
+# seconds without heartbeat before collector process is reported down
+HEARTBEAT_TIMEOUT = 600
+
+
+def format_health(states, now):
+    if not states:
+        return "Collector status: no heartbeat"
+    lines = []
+    for name, (heartbeat, _) in sorted(states.items()):
+        age = now - heartbeat.time
+        status = "running" if age < HEARTBEAT_TIMEOUT else "DOWN"
+        lines.append("Collector {}: {} pid={} heartbeat {:.0f}s ago iterations={} pairs={}".format(
+            name, status, heartbeat.pid, age, heartbeat.iterations, heartbeat.pairs))
+    return "\n".join(lines)
+
+
+def relative_spread(state):
+    return (state.ask - state.bid) / state.ask if state.ask else 0.0
+
+
+def format_live(states, now, key, pattern=None, top=20):
+    # pairs of all collector processes sorted by key, pattern filters by
+    # exchange or pair name
+    pairs = [s for _, (_, pair_states) in sorted(states.items()) for s in pair_states]
+    if pattern:
+        pattern = pattern.upper()
+        pairs = [s for s in pairs if pattern in s.pair.upper() or pattern in s.exchange.upper()]
+    pairs.sort(key=key, reverse=True)
+    lines = []
+    for s in pairs[:top]:
+        lines.append("{} : {} bid={:.8g} ask={:.8g} spread={:.4f} trades={:.3f}/s btc={:.8g} ({:.0f}s ago)".format(
+            s.exchange, s.pair, s.bid, s.ask, relative_spread(s), s.trade_rate, s.btc_rate, now - s.updated))
+    return "\n".join(lines) or "no pairs"
+
+
 class ReportCollector(Collector):
+    SPREAD_LIMIT = 0.005
+    # live state belongs to collector process
+    LIVE_STATE = False
+
+    def log(self, *args, **kwargs):
+        # archived days are read only
+        if not archive.is_archived(self.path):
+            super().log(*args, **kwargs)
+
     def get_suitable_pairs(self):
-        pairs = []
-        self.pair_volumes = {}
-        with self.file('pairs', 'r') as f:
-            for l in f:
-                args = [x.strip() for x in l.split(',')]
-                pair = (args[1], args[2])
-                pairs.append(pair)
-                self.pair_volumes[pair] = float(args[5])
-        return pairs
-
-    def load(f):
-        state = pickle.load(f)
+        self.writer.flush()
+        self.pair_volumes = read_pair_volumes(self.file_path('pairs'))
+        return list(self.pair_volumes)
+
+    def catch_up_aggregates(self):
+        for exchange_name, pair in self.pairs:
+            loader.catch_up(self.aggregates, exchange_name, pair, self.file_path)
+
+    def load(state):
         collector_root = state['current_collector_root']
-        pairs = state['pairs']
+        pairs = [tuple(p) for p in state['pairs']]
         collector = ReportCollector(collector_root, pairs=pairs)
 
         collector.pair_volumes = {}
@@ -51,9 +131,13 @@ class ReportCollector(Collector):
     def generate_report(self):
         return [self.pair_report(*p) for p in self.pairs if self.is_pair_good(*p)]
 
+    def iter_report(self):
+        for p in self.pairs:
+            if self.is_pair_good(*p):
+                yield self.format_report_record(self.pair_report(*p))
+
     def report(self):
-        report = self.generate_report()
-        return "\n".join(self.format_report_record(r) for r in report)
+        return "\n".join(self.iter_report())
 
     @staticmethod
     def format_report_record(record):
@@ -67,59 +151,39 @@ class ReportCollector(Collector):
             """.format(**record)
 
     def is_pair_good(self, exchange_name, pair):
-        return self.spread(exchange_name, pair) >= 0.005
+        return self.spread(exchange_name, pair) >= self.SPREAD_LIMIT
 
     def spread(self, exchange_name, pair):
-        with self.file(("spread", exchange_name, pair), "r") as f:
-            spread = 0.0
-            count = 0
-            for l in f:
-                _, ask, bid = tuple(s.strip() for s in l.split(','))
-                ask = float(ask)
-                bid = float(bid)
-                spread += (ask-bid)/ask
-                count += 1
-            spread /= count
-            return spread
+        # aggregates are loaded from sidecar and caught up in Collector.__init__
+        return self.aggregates.get(exchange_name, pair).spread()
 
     def pair_report(self, exchange_name, pair):
-        spread = self.spread(exchange_name, pair)
+        aggregate = self.aggregates.get(exchange_name, pair)
         volume = self.pair_volumes[(exchange_name, pair)]
-        order_count = 0
-        total_time = 0
-        total_volume = 0
-        with self.file(('trades', exchange_name, pair), 'r') as f:
-            time_start = None
-            time_end = None
-            for line in f:
-                data = tuple(s.strip() for s in line.split(','))
-                _, timestamp, _, side, price, amount, br, amount_btc = data
-                amount = float(amount)
-                amount_btc = float(amount_btc)
-                timestamp = int(timestamp)
-                if br == 'break=True':
-                    if time_start is not None:
-                        total_time += (time_end - time_start) / 1000
-                    time_start = timestamp
-
-                time_end = timestamp
-                order_count += 1
-                total_volume += amount_btc
-            total_time += (time_end - time_start) / 1000
-            avg_time = total_time / order_count
-            avg_volume = total_volume / order_count
-            return {
-                'exchange': exchange_name,
-                'pair': pair, 
-                'volume': float(volume),
-                'avg_time': avg_time,
-                'avg_volume': avg_volume,
-                'order_count': order_count,
-                'spread': self.spread(exchange_name, pair)
-            }
+        return self.aggregate_report(exchange_name, pair, volume, aggregate)
+
+    @staticmethod
+    def aggregate_report(exchange_name, pair, volume, aggregate):
+        order_count = aggregate.trade_count
+        return {
+            'exchange': exchange_name,
+            'pair': pair, 
+            'volume': float(volume),
+            'avg_time': aggregate.session_time() / order_count if order_count else 0.0,
+            'avg_volume': aggregate.volume_btc / order_count if order_count else 0.0,
+            'order_count': order_count,
+            'spread': aggregate.spread()
+        }
 
 
 class ReportManager(CollectorManager):
+    OWNS_STATE = False
+
+    def __init__(self, root, **kwargs):
+        # (date, back, days) -> (files signature, report parts)
+        self.cache = {}
+        super().__init__(root, **kwargs)
+
     def save_state(self):
         pass
 
@@ -129,14 +193,90 @@ class ReportManager(CollectorManager):
     def new_collector(self):
         self.load_state()
 
-    def report(self, back):
+    def day_root(self, back):
         date = datetime.datetime.now()
         delta = datetime.timedelta(days=back)
         date -= delta
         date = str(date.date())
-        collector_root = path.join(self.root, date)
-        collector = self.factory(collector_root)
-        return collector.report()
+        return path.join(self.root, date)
+
+    def report(self, back):
+        return "\n".join(self.iter_report(back))
+
+    def report_range(self, back, days, processes=None):
+        return "\n".join(self.iter_report(back, days, processes))
+
+    def iter_report(self, back, days=1, processes=None):
+        # formatted pair records as they are ready, finished reports are
+        # cached until files of reported days change
+        key = (str(datetime.date.today()), back, days)
+        signature = self.signature(back, days)
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] == signature:
+            yield from cached[1]
+            return
+        if days > 1:
+            records = self.iter_report_range(back, days, processes)
+        else:
+            records = self.iter_report_day(back)
+        parts = []
+        for part in records:
+            parts.append(part)
+            yield part
+        self.cache[key] = (signature, parts)
+
+    def signature(self, back, days):
+        result = []
+        for i in range(days):
+            collector_root = self.day_root(back + i)
+            if archive.is_archived(collector_root):
+                stat = os.stat(archive.archive_path(collector_root))
+                result.append((collector_root, archive.SUFFIX, stat.st_size, stat.st_mtime_ns))
+                continue
+            if not path.isdir(collector_root):
+                continue
+            for entry in os.scandir(collector_root):
+                # building a report logs into collector_log.csv itself
+                if entry.name.startswith('collector_log'):
+                    continue
+                stat = entry.stat()
+                result.append((collector_root, entry.name, stat.st_size, stat.st_mtime_ns))
+        return sorted(result)
+
+    def iter_report_day(self, back):
+        collector = self.factory(self.day_root(back))
+        try:
+            yield from collector.iter_report()
+        finally:
+            collector.close()
+
+    def iter_report_range(self, back, days, processes=None):
+        # aggregate `days` days ending `back` days ago, one task per (day, pair)
+        aggregates = {}
+        volumes = {}
+        pending = {}
+        with ProcessPoolExecutor(processes) as pool:
+            futures = {}
+            for i in range(days):
+                collector_root = self.day_root(back + i)
+                if not archive.day_exists(collector_root):
+                    continue
+                pair_volumes = read_pair_volumes(path.join(collector_root, 'pairs.csv'))
+                store = AggregateStore(collector_root)
+                store.load()
+                for key, volume in pair_volumes.items():
+                    future = pool.submit(day_pair_aggregate, collector_root, *key, store.get(*key))
+                    futures[future] = key
+                    volumes.setdefault(key, []).append(volume)
+                    pending[key] = pending.get(key, 0) + 1
+            for future in as_completed(futures):
+                key = futures[future]
+                aggregates.setdefault(key, PairAggregate()).merge(future.result())
+                pending[key] -= 1
+                if pending[key] == 0 and aggregates[key].spread() >= ReportCollector.SPREAD_LIMIT:
+                    volume = sum(volumes[key]) / len(volumes[key])
+                    record = ReportCollector.aggregate_report(key[0], key[1], volume, aggregates[key])
+                    yield ReportCollector.format_report_record(record)
 
 
 if __name__ == '__main__':
@@ -148,13 +288,30 @@ if __name__ == '__main__':
     async def on_ready():
         print("ready")
 
+    def live_states():
+        try:
+            return livestate.read_all(path.join(ROOT, "collector_manager"))
+        except FileNotFoundError:
+            return {}
+
+    async def say_long(text):
+        for i in range(0, len(text), 1990):
+            await bot.say("```" + text[i:i+1990] + "```")
+
     @bot.command()
     async def check():
         await bot.say("Bot status: online")
-        ps = subprocess.Popen(('ps', '-A'), stdout=subprocess.PIPE)
-        output = subprocess.check_output(('grep', 'collector.py'), stdin=ps.stdout)
-        ps.wait()
-        await bot.say("Collector status: " + output.decode('utf-8'))
+        await bot.say(format_health(live_states(), time.time()))
+
+    @bot.command()
+    async def live(pattern=None):
+        states = live_states()
+        now = time.time()
+        await say_long(format_health(states, now) + "\n" + format_live(states, now, lambda s: s.trade_rate, pattern))
+
+    @bot.command()
+    async def spread(pattern=None):
+        await say_long(format_live(live_states(), time.time(), relative_spread, pattern))
 
     @bot.command()
     async def restart():
@@ -168,20 +325,37 @@ if __name__ == '__main__':
             await bot.say(msg)
 
     @bot.command()
-    async def report(back:int=1):
+    async def stats():
+        # shard workers export metrics.<n>.json next to metrics.json
+        snapshot = metrics.load_all(path.join(ROOT, "collector_manager"))
+        await say_long(format_stats(snapshot))
+
+    @bot.command()
+    async def report(back:int=1, days:int=1):
         await bot.say("Собираю отчет")
-        try:
-            report = report_manager.report(back)
-            if len(report) > 2000:
-                r = [report[r:r+2000] for r in range(0, len(report), 2000)]
-            else:
-                r = [report]
-            for i in r:
-                await bot.say(i)
-            await bot.say("Всёшеньки")
-        except Exception as e:
-            await bot.say(traceback.format_exc())
-            raise e
+        # report is generated in executor, records come back through queue
+        loop = asyncio.get_event_loop()
+        queue = asyncio.Queue()
+
+        def produce():
+            try:
+                for part in report_manager.iter_report(back, days):
+                    loop.call_soon_threadsafe(queue.put_nowait, (part, None))
+                loop.call_soon_threadsafe(queue.put_nowait, (None, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (traceback.format_exc(), e))
+
+        loop.run_in_executor(None, produce)
+        while True:
+            part, error = await queue.get()
+            if error is not None:
+                await bot.say(part)
+                raise error
+            if part is None:
+                break
+            for i in range(0, len(part), 2000):
+                await bot.say(part[i:i+2000])
+        await bot.say("Всёшеньки")
 
     with open(sys.argv[1], 'r') as token_file:
         token = token_file.read()
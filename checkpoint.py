@@ -0,0 +1,91 @@
+import json
+import os
+
+from os import path
+
+
+class Checkpoint:
+    # State as flat records {key: json value}. save() appends only changed
+    # records to <name>.journal, every compact_every saves the records are
+    # written to <name>.json with write-then-rename and the journal restarts.
+    # A partial last journal line (crash mid-write) is ignored on load and cut
+    # off by the owner, readers (owner=False) never modify the files.
+    VERSION = 1
+
+    def __init__(self, directory, name='state', compact_every=100, owner=True):
+        self.snapshot_path = path.join(directory, name + '.json')
+        self.journal_path = path.join(directory, name + '.journal')
+        self.compact_every = compact_every
+        self.owner = owner
+        self.records = {}
+        self.entries = 0
+
+    def exists(self):
+        return path.exists(self.snapshot_path) or path.exists(self.journal_path)
+
+    def load(self):
+        records = {}
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot['version'] != self.VERSION:
+                return None
+            records = snapshot['records']
+        except FileNotFoundError:
+            pass
+        self.entries = 0
+        try:
+            with open(self.journal_path, 'rb+' if self.owner else 'rb') as f:
+                good = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError("partial journal line")
+                        apply_changes(records, json.loads(line.decode('utf-8')))
+                    except ValueError:
+                        # drop damaged tail so next save appends after good lines
+                        if self.owner:
+                            f.truncate(good)
+                        break
+                    good += len(line)
+                    self.entries += 1
+        except FileNotFoundError:
+            pass
+        self.records = records
+        return dict(records)
+
+    def save(self, records):
+        changes = {k: v for k, v in records.items() if self.records.get(k) != v}
+        changes.update({k: None for k in self.records if k not in records})
+        if not changes:
+            return
+        self.records = dict(records)
+        # journaled before compaction, so the journal always ends in the
+        # current state
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(changes) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries += 1
+        if self.entries >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.VERSION, 'records': self.records}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        # crash before truncate replays the whole journal over the new
+        # snapshot, its last value of every key is the snapshot value
+        open(self.journal_path, 'w').close()
+        self.entries = 0
+
+
+def apply_changes(records, changes):
+    for key, value in changes.items():
+        if value is None:
+            records.pop(key, None)
+        else:
+            records[key] = value
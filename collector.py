@@ -6,14 +6,22 @@ import os
 import pickle
 import threading
 import time
-import subprocess
 import traceback
 
 from os import path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import exchange
-from RepeatedTimer import RepeatedTimer
+import archive
+import metrics
+from writer import BufferedWriter
+import bookstore
+from aggregates import AggregateStore
+from polling import PollPolicy
+from checkpoint import Checkpoint
+from scheduler import Scheduler
+import livestate
 
 
 ROOT = "/home/hukumka/src/cryptostats/data/"
@@ -29,17 +37,45 @@ def print(*args):
 class Collector:
     EXCHANGES = ('exmo', 'hitbtc')
     BTC_VOLUME_LIMIT = 20
-
-    def __init__(self, root, pairs=None):
+    WORKERS = 8
+    # 'csv' or one of bookstore.STORES
+    BOOK_STORAGE = 'csv'
+    # poll each pair at its own interval within bounds (see polling.PollPolicy)
+    ADAPTIVE_POLLING = False
+    POLL_INTERVAL_BOUNDS = (30, 600)
+    # generic files with timeindex sidecar
+    TIME_INDEXED = ('trades', 'spread')
+    # publish latest pair state to collector_manager/live*.state (see livestate)
+    LIVE_STATE = True
+
+    def __init__(self, root, pairs=None, cursors=None, worker=None):
+        # worker is number of shards.run_worker process, workers keep their own
+        # log and aggregates files
         self.csv_list = {
-            'log': 'collector_log.csv',
+            'log': 'collector_log.csv' if worker is None else 'collector_log.{}.csv'.format(worker),
             'all_pairs': 'all_pairs.csv',
             'pairs': 'pairs.csv',
         }
         self.path = root
+        self.worker = worker
+        self.cache_dir = path.join(path.dirname(path.normpath(root)), "collector_manager")
         self.graphs = {}
+        self.graphs_lock = threading.Lock()
+        self.writer = BufferedWriter()
+        self.books = None
+        if self.BOOK_STORAGE in bookstore.STORES:
+            self.books = bookstore.STORES[self.BOOK_STORAGE](self.writer)
         self.iterations = 0
-        if not path.isdir(self.path):
+        self.pending_pairs = None
+        self.scan_thread = None
+        self.scan_failed = False
+        self.polling = None
+        if self.ADAPTIVE_POLLING:
+            self.polling = PollPolicy(*self.POLL_INTERVAL_BOUNDS)
+        self.live = None
+        if self.LIVE_STATE and path.isdir(self.cache_dir):
+            self.live = livestate.LiveState(path.join(self.cache_dir, livestate.file_name(worker)))
+        if not path.isdir(self.path) and not archive.is_archived(self.path):
             os.mkdir(self.path)
         if pairs is None:
             print("trying pairs")
@@ -49,50 +85,154 @@ class Collector:
         print("Selected pairs:")
         print(self.pairs)
         print('------------------')
+        if cursors is None:
+            self.cursors = self.read_cursors()
+        else:
+            # writer may have flushed rows after cursors were checkpointed
+            self.cursors = latest_cursors(cursors, self.read_cursors())
+        self.aggregates = AggregateStore(self.path, worker)
+        # worker checkpoints offsets of every loaded pair, so only its own are loaded
+        self.aggregates.load(None if worker is None else self.pairs)
+        self.catch_up_aggregates()
 
         self.log('log', 'Collector.__init__("{}")'.format(root))
         
-    def log(self, *args):
+    def catch_up_aggregates(self):
+        for exchange_name, pair in self.pairs:
+            self.aggregates.catch_up(exchange_name, pair, self.file_path)
+
+    def log(self, *args, timestamp=None):
+        # timestamp is datetime or already formatted one
         file_descriptor = args[0]
-        data = [str(datetime.now())] + list(args[1:])
-        with self.file(file_descriptor) as f:
-            f.write(', '.join(str(d) for d in data) + '\n')
+        if timestamp is None:
+            timestamp = datetime.now()
+        data = [timestamp] + list(args[1:])
+        key = None
+        if not isinstance(file_descriptor, str) and file_descriptor[0] in self.TIME_INDEXED and isinstance(timestamp, datetime):
+            key = timestamp.timestamp()
+        self.writer.write(self.file_path(file_descriptor), ', '.join(str(d) for d in data) + '\n', key)
 
     def file(self, id, param="a"):
+        # make rows still buffered by writer visible to the caller
+        self.writer.flush()
+        if param == "r":
+            return archive.open_file(self.file_path(id), param)
         return open(self.file_path(id), param)
 
-    def file_path(self, id):
+    def close(self):
+        self.writer.close()
+        if self.live is not None:
+            self.live.close()
+
+    def file_path(self, id, ext=".csv"):
         if isinstance(id, str):
             if id in self.csv_list:
                 return path.join(self.path, self.csv_list[id])
             else:
                 raise Exception("Unknown log id: {}".format(id))
         else:
-            return path.join(self.path, "generic_" + "_".join(i.replace("/", "-") for i in id) + ".csv")
+            return generic_file_path(self.path, id, ext)
 
     def last_line(self, id):
-        return subprocess.check_output(['tail', '-1', self.file_path(id)])
+        # last complete line of the file, partial line left by a crash is ignored
+        with open(self.file_path(id), 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            chunk = b''
+            position = end
+            while position > 0:
+                step = min(4096, position)
+                position -= step
+                f.seek(position)
+                chunk = f.read(step) + chunk
+                lines = chunk.split(b'\n')
+                # lines[-1] is partial (or empty when file ends with newline)
+                if len(lines) > 2 or (position == 0 and len(lines) > 1):
+                    return lines[-2].decode('utf-8')
+            return None
+
+    def read_cursors(self):
+        # (timestamp, trade id) of the last stored trade for every pair
+        cursors = {}
+        for exchange_name, pair in self.pairs:
+            try:
+                line = self.last_line(("trades", exchange_name, pair))
+            except FileNotFoundError:
+                continue
+            if line:
+                data = [x.strip() for x in line.split(',')]
+                cursors[(exchange_name, pair)] = (int(data[1]), data[2])
+        return cursors
 
     def get_suitable_pairs(self):
         result = []
         for e in self.EXCHANGES:
-            api = exchange.api_by_name(e)
-            pairs = exchange.PairGraph(api)
-            self.graphs[e] = pairs
+            pairs = self.get_graph(e)
+            tickers = {}
+            if pairs.exchange.has.get('fetchTickers'):
+                tickers = pairs.exchange.fetch_tickers()
+                pairs.rates.update(tickers)
             for pair in pairs.markets:
-                if self.is_pair_suitable(e, pairs, pair):
+                if self.is_pair_suitable(e, pairs, pair, tickers.get(pair['symbol'])):
                     result.append((e, pair['symbol']))
         return result
 
-    def get_graph(self, exchange_name):
-        if exchange_name not in self.graphs:
-            self.graphs[exchange_name] = exchange.PairGraph(exchange.api_by_name(exchange_name))
-        return self.graphs[exchange_name]
+    def rescan_pairs(self):
+        # select pairs in background, collect() swaps them in once ready
+        def scan():
+            try:
+                self.pending_pairs = self.get_suitable_pairs()
+            except Exception:
+                print(traceback.format_exc())
+                self.log('log', 'Collector.rescan_pairs failed')
+                self.scan_failed = True
+        self.scan_failed = False
+        self.scan_thread = threading.Thread(target=scan, daemon=True)
+        self.scan_thread.start()
+
+    def update_pairs(self):
+        # swap in finished scan, failed one is started again
+        if self.pending_pairs is not None:
+            self.swap_pairs()
+        elif self.scan_failed:
+            self.rescan_pairs()
+
+    def carry_pairs(self, previous):
+        # pairs.csv rows of previous day for the selection kept until rescan
+        # finishes, so reports of this day have volumes from the start
+        volumes = {}
+        try:
+            with archive.open_file(previous.file_path('pairs'), 'r') as f:
+                for line in f:
+                    data = [x.strip() for x in line.split(',')]
+                    volumes[(data[1], data[2])] = data[3:6]
+        except FileNotFoundError:
+            pass
+        for exchange_name, pair in self.pairs:
+            self.log('pairs', exchange_name, pair, *volumes.get((exchange_name, pair), (0, 0, 0)))
+        self.writer.flush()
+
+    def swap_pairs(self):
+        selected = self.pending_pairs
+        self.pending_pairs = None
+        added = [p for p in selected if p not in self.pairs]
+        removed = [p for p in self.pairs if p not in selected]
+        self.pairs = [p for p in self.pairs if p in selected] + added
+        print("Pairs added: {} removed: {}".format(added, removed))
+        self.log('log', 'Collector.swap_pairs({}, {})'.format(added, removed))
 
-    def is_pair_suitable(self, exchange, pairs_graph, pair):
+    def get_graph(self, exchange_name):
+        with self.graphs_lock:
+            if exchange_name not in self.graphs:
+                cache_dir = self.cache_dir if path.isdir(self.cache_dir) else None
+                with metrics.registry.timer('pair_graph.build.' + exchange_name):
+                    self.graphs[exchange_name] = exchange.PairGraph(exchange.shared_api(exchange_name), cache_dir=cache_dir)
+            return self.graphs[exchange_name]
+
+    def is_pair_suitable(self, exchange, pairs_graph, pair, ticker=None):
         print("Checking pair {}:\"{}\"".format(exchange, pair['symbol']))
-        ticker = pairs_graph.exchange.fetch_ticker(pair['symbol'])
-        bid_volume, quote_volume = ticker['bidVolume'], ticker['quoteVolume']
+        if ticker is None:
+            ticker = pairs_graph.exchange.fetch_ticker(pair['symbol'])
+        bid_volume, quote_volume = ticker['bidVolume'], ticker['quoteVolume'] or 0
         btc_volume = pairs_graph.convert_currency(pair['quote'], 'BTC', quote_volume)
         self.log('all_pairs', exchange, pair['symbol'], bid_volume, quote_volume, btc_volume)
         print_if_verbose(exchange, pair['symbol'], bid_volume, quote_volume, btc_volume, btc_volume > self.BTC_VOLUME_LIMIT)
@@ -104,14 +244,65 @@ class Collector:
 
 
     def collect(self):
+        with metrics.registry.timer('collect.cycle'):
+            self.collect_cycle()
+
+    def collect_cycle(self):
         print("Collector.collect({})".format(self.path))
         self.log('log', "Collector.collect({})".format(self.path))
-        for exchange_name, pair in self.pairs:
-            api = exchange.api_by_name(exchange_name)
-            self.collect_trades(api, exchange_name, pair)
-            self.collect_order_book(api, exchange_name, pair)
-            time.sleep(0.5)
+        self.update_pairs()
+        exchanges = set(e for e, _ in self.pairs)
+        for exchange_name in exchanges:
+            try:
+                self.get_graph(exchange_name).update_valuation('BTC')
+            except Exception:
+                # pairs are still collected, btc rates of live state are nan
+                print(traceback.format_exc())
+                self.log('log', 'Collector.update_valuation({}) failed'.format(exchange_name))
+                metrics.registry.count('valuation.errors')
+        pairs = self.pairs
+        if self.polling is not None:
+            rates = {e: exchange.shared_api(e).bucket.rate for e in exchanges}
+            pairs = self.polling.due_pairs(self.pairs, rates)
+        if self.WORKERS > 1:
+            # requests are throttled per exchange by shared_api token buckets
+            with ThreadPoolExecutor(self.WORKERS) as pool:
+                futures = [pool.submit(self.try_collect_pair, e, p) for e, p in interleave(pairs)]
+                for f in futures:
+                    f.result()
+        else:
+            for exchange_name, pair in pairs:
+                self.try_collect_pair(exchange_name, pair)
         self.iterations += 1
+        self.writer.flush()
+        self.aggregates.checkpoint(self.file_path)
+        if self.live is not None:
+            self.live.beat(self.iterations)
+
+    def try_collect_pair(self, exchange_name, pair):
+        # failed pair is retried next cycle, the rest of the cycle is still
+        # flushed and checkpointed
+        try:
+            self.collect_pair(exchange_name, pair)
+        except Exception:
+            print(traceback.format_exc())
+            self.log('log', 'Collector.collect_pair({}, {}) failed'.format(exchange_name, pair))
+            metrics.registry.count('collect.errors')
+
+    def collect_pair(self, exchange_name, pair):
+        api = exchange.shared_api(exchange_name)
+        new_count, total_count = self.collect_trades(api, exchange_name, pair)
+        order_book = self.collect_order_book(api, exchange_name, pair)
+        if self.live is not None:
+            try:
+                btc_rate = self.get_graph(exchange_name).valuate(pair.split('/')[0], [1.0], 'BTC')[0]
+            except Exception:
+                # valuation failure is counted by collect_cycle
+                btc_rate = float('nan')
+            self.live.update(exchange_name, pair, order_book, self.cursors.get((exchange_name, pair)), new_count, btc_rate)
+        if self.polling is not None:
+            interval = self.polling.observe((exchange_name, pair), new_count, total_count)
+            print_if_verbose("Next poll of {} {} in {:.0f}s".format(exchange_name, pair, interval))
 
     def collect_order_book(self, api, exchange_name, pair):
         print("Collector.collect_order_book({}, {})".format(exchange_name, pair))
@@ -119,97 +310,181 @@ class Collector:
         book_file_id = ("order_book", exchange_name, pair)
         file_id = ("spread", exchange_name, pair)
         order_book = api.fetch_order_book(pair)
+        now = datetime.now()
+        now_text = str(now)
         print_if_verbose("Spread={}".format((order_book['asks'][0][0]-order_book['bids'][0][0])/order_book['bids'][0][0]))
-        self.log(file_id, order_book['asks'][0][0], order_book['bids'][0][0])
+        self.log(file_id, order_book['asks'][0][0], order_book['bids'][0][0], timestamp=now)
+        self.aggregates.get(exchange_name, pair).add_spread(order_book['asks'][0][0], order_book['bids'][0][0])
         print_if_verbose("asks: ", order_book['asks'])
         print_if_verbose("bids: ", order_book['bids'])
+        if self.books is not None:
+            book_path = self.file_path(book_file_id, ext="")
+            self.books.append(book_path, time.time(), self.iterations, order_book['asks'], order_book['bids'])
+            return order_book
         for ask in order_book['asks']:
-            self.log(book_file_id, self.iterations, 'ask', ask[0], ask[1])
+            self.log(book_file_id, self.iterations, 'ask', ask[0], ask[1], timestamp=now_text)
         for bid in order_book['bids']:
-            self.log(book_file_id, self.iterations, 'bid', bid[0], bid[1])
+            self.log(book_file_id, self.iterations, 'bid', bid[0], bid[1], timestamp=now_text)
+        return order_book
 
     def collect_trades(self, api, exchange_name, pair):
         pair_from, pair_to = tuple(pair.split('/'))
         print("Collector.collect_trades({}, {})".format(exchange_name, pair))
         self.log('log', "Collector.collect_trades({}, {})".format(exchange_name, pair))
         file_id = ("trades", exchange_name, pair)
-        try:
-            last_trade_data = self.last_line(file_id).decode('utf-8')
-            last_trade_data = [x.strip() for x in last_trade_data.split(',')]
-            timestamp = int(last_trade_data[1])
-            trade_id = int(last_trade_data[2])
+        if (exchange_name, pair) in self.cursors:
+            timestamp, trade_id = self.cursors[(exchange_name, pair)]
             print_if_verbose("Log found: keep adding records with timestamp>{}".format(timestamp))
-            new_only = True
-        except subprocess.CalledProcessError:
+        else:
             timestamp = 0
             trade_id = None
             print_if_verbose("Log not found: create new and add all records")
-            new_only = True
+        new_only = True
 
         trades = api.fetch_trades(pair)
         trades.sort(key=lambda x: (x['timestamp'], x['id']))
+        new_trades = []
         for t in trades:
-            if t['timestamp'] >= timestamp and t['id'] != trade_id:
+            if t['timestamp'] >= timestamp and str(t['id']) != trade_id:
                 timestamp = t['timestamp']
-                trade_id = t['id']
-                side = t['side']
-                price = t['price']
-                amount = t['amount']
-                amount_btc = self.get_graph(exchange_name).convert_currency(pair_from, 'BTC', amount)
-                self.log(file_id, timestamp, trade_id, side, price, amount, "break="+str(new_only), amount_btc)
+                trade_id = str(t['id'])
+                new_trades.append((t, new_only))
                 new_only = False
-                print_if_verbose("Add record timestamp={} id={} volume={} price={}".format(timestamp, trade_id, amount, price))
             else:
                 new_only = False
                 print_if_verbose("Skip record with timestamp {}<{}".format(t['timestamp'], timestamp))
+        amounts_btc = self.get_graph(exchange_name).valuate(pair_from, [t['amount'] for t, _ in new_trades], 'BTC')
+        aggregate = self.aggregates.get(exchange_name, pair)
+        for (t, br), amount_btc in zip(new_trades, amounts_btc):
+            self.log(file_id, t['timestamp'], t['id'], t['side'], t['price'], t['amount'], "break="+str(br), amount_btc)
+            aggregate.add_trade(t['timestamp'], amount_btc, br)
+            print_if_verbose("Add record timestamp={} id={} volume={} price={}".format(t['timestamp'], t['id'], t['amount'], t['price']))
+        if trade_id is not None:
+            self.cursors[(exchange_name, pair)] = (timestamp, trade_id)
         self.log('log', 'Collector.collect_trades', exchange_name, pair)
+        return len(new_trades), len(trades)
 
-    def save_state(self, f):
-        pickle.dump({
+    def save_state(self):
+        # flat json records for checkpoint.Checkpoint
+        state = {
             'current_collector_root': self.path,
-            'pairs': self.pairs,
-            'iterations': self.iterations
-        }, f)
+            'pairs': [list(p) for p in self.pairs],
+            'iterations': self.iterations,
+        }
+        for (exchange_name, pair), cursor in list(self.cursors.items()):
+            state['cursor/{}/{}'.format(exchange_name, pair)] = list(cursor)
+        return state
 
-    def load(f):
-        state = pickle.load(f)
+    def load(state):
         collector_root = state['current_collector_root']
-        pairs = state['pairs']
+        pairs = [tuple(p) for p in state['pairs']]
         iterations = state['iterations']
-        collector = Collector(collector_root, pairs=pairs)
+        collector = Collector(collector_root, pairs=pairs, cursors=state_cursors(state))
         collector.iterations = iterations
         collector.log('log', 'Collector.load({}, {})'.format(collector_root, pairs))
         return collector
 
 
+def state_cursors(state):
+    cursors = {}
+    for key, value in state.items():
+        if key.startswith('cursor/'):
+            _, exchange_name, pair = key.split('/', 2)
+            cursors[(exchange_name, pair)] = tuple(value)
+    return cursors or None
+
+
+
+def latest_cursors(saved, stored):
+    # later of checkpointed cursor and the last trade found in its file
+    cursors = dict(saved)
+    for key, cursor in stored.items():
+        if key not in cursors or cursor[0] >= cursors[key][0]:
+            cursors[key] = cursor
+    return cursors
+
+
+def interleave(pairs):
+    # round robin over exchanges, so pool threads do not all wait on the
+    # token bucket of one exchange while others are idle
+    queues = {}
+    for exchange_name, pair in pairs:
+        queues.setdefault(exchange_name, []).append(pair)
+    result = []
+    for i in range(max((len(q) for q in queues.values()), default=0)):
+        for exchange_name, queue in queues.items():
+            if i < len(queue):
+                result.append((exchange_name, queue[i]))
+    return result
+
+
+def generic_file_path(root, id, ext=".csv"):
+    return path.join(root, "generic_" + "_".join(i.replace("/", "-") for i in id) + ext)
+
 
 class CollectorManager:
+    # pack day directory into archive.pack_day archive once it is rotated out
+    ARCHIVE = True
+    METRICS_FILE = 'metrics.json'
+    # only the collector process writes state, others just read it
+    OWNS_STATE = True
+
     def __init__(self, root, 
             factory=Collector, 
             forget_state=False,
-            state_file='state.pickle'
+            state_file='state',
+            processes=1
     ):
         self.root = root
         self.factory = factory
         self.state_file = state_file
+        # with several processes manager collector only selects pairs and
+        # keeps state, collection is done by shards.ShardPool workers
+        self.shards = None
+        if processes > 1:
+            from shards import ShardPool, SETTINGS
+            settings = {name: getattr(factory, name) for name in SETTINGS}
+            self.shards = ShardPool(processes, settings, verbose=cmd_args.verbose)
+        self.checkpoint = Checkpoint(path.join(self.root, "collector_manager"), state_file, owner=self.OWNS_STATE)
         if forget_state or not self.load_state() :
             self.new_collector()
 
     def save_state(self):
-        with open(path.join(self.root, "collector_manager", self.state_file), 'wb') as f:
-            self.collector.save_state(f)
+        self.checkpoint.save(self.collector.save_state())
 
     def load_state(self):
         try:
-            with open(path.join(self.root, "collector_manager", self.state_file), 'rb') as f:
-                self.collector = self.factory.load(f)
+            if self.checkpoint.exists():
+                state = self.checkpoint.load()
+            else:
+                state = self.load_pickle_state()
+            if state is None:
+                return False
+            self.collector = self.factory.load(state)
             return True
         except (FileNotFoundError, KeyError):
             return False
 
+    def load_pickle_state(self):
+        # state.pickle written before checkpoints were introduced
+        with open(path.join(self.root, "collector_manager", "state.pickle"), 'rb') as f:
+            state = pickle.load(f)
+        for (exchange_name, pair), cursor in state.pop('cursors', {}).items():
+            state['cursor/{}/{}'.format(exchange_name, pair)] = list(cursor)
+        return state
+
     def collect(self):
-        self.collector.collect()
+        if self.shards is None:
+            self.collector.collect()
+        else:
+            self.collector.update_pairs()
+            with metrics.registry.timer('collect.cycle'):
+                self.shards.collect(self.collector)
+            self.collector.writer.flush()
+            if self.collector.live is not None:
+                self.collector.live.beat(self.collector.iterations)
         self.save_state()
+        metrics.registry.export(path.join(self.root, "collector_manager", self.METRICS_FILE))
 
     def is_old(self):
         date = str(datetime.now().date())
@@ -218,15 +493,39 @@ class CollectorManager:
 
     def take_collected(self):
         collector_root = self.collector.path
+        if self.shards is not None:
+            # workers must be done with the day before it is archived
+            self.shards.stop()
+        self.collector.close()
         self.new_collector()
+        if self.ARCHIVE:
+            threading.Thread(target=self.archive_day, args=(collector_root,)).start()
         return collector_root
 
+    def archive_day(self, collector_root):
+        try:
+            print("Archived", archive.pack_day(collector_root))
+        except Exception:
+            print(traceback.format_exc())
+
     def new_collector(self):
         date = str(datetime.now().date())
         collector_root = path.join(self.root, date)
-        self.collector = self.factory(collector_root)
+        previous = getattr(self, 'collector', None)
+        if previous is None:
+            self.collector = self.factory(collector_root)
+        else:
+            # keep collecting previous selection until the new one is ready
+            self.collector = self.factory(collector_root, pairs=list(previous.pairs))
+            self.collector.carry_pairs(previous)
+            self.collector.rescan_pairs()
         self.save_state()
 
+    def close(self):
+        if self.shards is not None:
+            self.shards.stop()
+        self.collector.close()
+
 
 class Args:
     def __init__(self):
@@ -244,38 +543,51 @@ if __name__ == '__main__':
     with open("data/collector_manager/last_error.txt", "w") as f:
         f.write("empty\n")
         f.close()
+    manager = None
     try:
-        running = True
+        INTERVAL = 120
+
+        def collect():
+            if manager.is_old():
+                manager.take_collected()
+                print_if_verbose("new manager created")
+            metrics.registry.gauge('scheduler', scheduler.stats())
+            manager.collect()
+            print_if_verbose("collected", scheduler.stats())
+
+        def write_last_error(error):
+            with open("data/collector_manager/last_error.txt", "w") as f:
+                f.write(error)
+
+        scheduler = Scheduler(INTERVAL, collect)
+        scheduler.on_error = write_last_error
         def stop_running(signum, frame):
-            global running
             print("Terminated", signum, frame)
-            running = False
+            scheduler.stop()
         signal.signal(signal.SIGINT, stop_running)
         signal.signal(signal.SIGTERM, stop_running)
  
         parser = argparse.ArgumentParser(description='Run collector process')
         parser.add_argument("-d", "--drop", action="store_true", help="ignore previous state")
         parser.add_argument("-v", "--verbose", action="store_true", help="Extra level of verbosity")
+        parser.add_argument("-j", "--jobs", type=int, default=Collector.WORKERS, help="Number of pairs collected in parallel")
+        parser.add_argument("--book-storage", choices=("csv",) + tuple(bookstore.STORES), default=Collector.BOOK_STORAGE, help="Order book storage format")
+        parser.add_argument("--no-archive", action="store_true", help="Keep finished days as plain directories")
+        parser.add_argument("--adaptive", action="store_true", help="Adapt poll interval of every pair to its trade rate")
+        parser.add_argument("-p", "--processes", type=int, default=1, help="Number of worker processes pairs are split between")
         cmd_args = parser.parse_args()
-        manager = CollectorManager(ROOT, forget_state=cmd_args.drop)
+        Collector.WORKERS = cmd_args.jobs
+        Collector.BOOK_STORAGE = cmd_args.book_storage
+        CollectorManager.ARCHIVE = not cmd_args.no_archive
+        if cmd_args.adaptive:
+            # pairs decide themselves when to poll, scheduler only ticks
+            Collector.ADAPTIVE_POLLING = True
+            scheduler.interval = Collector.POLL_INTERVAL_BOUNDS[0]
+        manager = CollectorManager(ROOT, forget_state=cmd_args.drop, processes=cmd_args.processes)
  
         print(cmd_args)
- 
-        INTERVAL = 120
- 
-        def collect():
-            if manager.is_old():
-                manager.take_collected()
-                print_if_verbose("new manager created")
-
-        manager.collect()
-        manager.save_state
-        print_if_verbose("collected")
 
-        timer = RepeatedTimer(INTERVAL, collect)
-        collect()  # timer will call only after interval passes
-        while running:
-            pass
+        scheduler.run()
     except Exception as e:
         with open("data/collector_manager/last_error.txt", "w") as f:
             f.write(traceback.format_exc())
@@ -283,4 +595,5 @@ if __name__ == '__main__':
         raise e
     finally:
         print("Cleaning up")
-        timer.stop()
+        if manager is not None:
+            manager.close()
@@ -1,7 +1,28 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+from array import array
+from collections import deque
+
 import ccxt
 
+import metrics
+
+
+# requests per second allowed for each exchange, overrides ccxt rateLimit
+REQUESTS_PER_SECOND = {}
+# seconds before conversion rates are refreshed
+RATE_TTL = 300
+# name -> factory of offline exchanges (see fake_exchange.FakeExchange)
+FAKE_EXCHANGES = {}
+
 def api_by_name(exchange_name):
-    if exchange_name == 'exmo':
+    if exchange_name in FAKE_EXCHANGES:
+        return FAKE_EXCHANGES[exchange_name]()
+    elif exchange_name == 'exmo':
         return ccxt.exmo()
     elif exchange_name == 'yobit':
         return ccxt.yobit()
@@ -13,38 +34,167 @@ def api_by_name(exchange_name):
         raise Exception("Unknown exchange")
 
 
+_shared_apis = {}
+_shared_apis_lock = threading.Lock()
+
+def shared_api(exchange_name):
+    # one long-lived throttled client per exchange, shared between threads
+    with _shared_apis_lock:
+        if exchange_name not in _shared_apis:
+            api = api_by_name(exchange_name)
+            rate = REQUESTS_PER_SECOND.get(exchange_name, 1000 / api.rateLimit)
+            _shared_apis[exchange_name] = ThrottledApi(api, TokenBucket(rate))
+        return _shared_apis[exchange_name]
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ThrottledApi:
+    # wraps ccxt exchange, every fetch_* call takes a token from the bucket
+    def __init__(self, api, bucket):
+        self.api = api
+        self.bucket = bucket
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if not name.startswith('fetch_'):
+            return attr
+        exchange_name = getattr(self.api, 'id', 'exchange')
+        def throttled(*args, **kwargs):
+            with metrics.registry.timer('ratelimit_wait.' + exchange_name):
+                self.bucket.acquire()
+            with metrics.registry.timer('api.{}.{}'.format(exchange_name, name)):
+                return attr(*args, **kwargs)
+        return throttled
+
+
 class PairGraph:
-    def __init__(self, exchange):
+    def __init__(self, exchange, cache_dir=None, rate_ttl=RATE_TTL, serve_stale=True):
         self.exchange = exchange
         self.markets = exchange.fetch_markets()
         self.currencies = all_currencies(self.markets)
         self.indexes = {c: i for i, c in enumerate(self.currencies)}
 
-        # determine convert paths
-        self.path = [[None for _ in self.indexes] for _ in self.indexes]
-        self.route = [[None for _ in self.indexes] for _ in self.indexes]
+        # adjacency lists, route[(i, j)] is True when i/j is a market and False for j/i
+        self.neighbours = [[] for _ in self.currencies]
+        self.route = {}
         for p in self.markets:
             i = self.indexes[p['base']]
             j = self.indexes[p['quote']]
-            self.path[i][j] = [i, j]
-            self.route[i][j] = True
-            self.path[j][i] = [j, i]
-            self.route[j][i] = False
+            self.neighbours[i].append(j)
+            self.route[(i, j)] = True
+            self.neighbours[j].append(i)
+            self.route[(j, i)] = False
+
+        # next hop trees keyed by destination, built lazily with BFS
+        self.next_hops = {}
+        self.next_hops_lock = threading.Lock()
+        self.cache_file = None
+        if cache_dir is not None:
+            name = "routes_{}_{}.pickle".format(getattr(exchange, 'id', 'exchange'), markets_hash(self.markets))
+            self.cache_file = os.path.join(cache_dir, name)
+            self.load_routes()
+        self.rates = RateCache(exchange, rate_ttl, serve_stale)
+        # multiplier into valuation_currency for every currency index, nan if unreachable
+        self.valuation = None
+        self.valuation_currency = None
+
+    def load_routes(self):
+        try:
+            with open(self.cache_file, 'rb') as f:
+                self.next_hops = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.next_hops = {}
+
+    def save_routes(self):
+        # shard workers may save the same cache at once
+        tmp = '{}.{}.{}.tmp'.format(self.cache_file, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            pickle.dump(self.next_hops, f)
+        os.replace(tmp, self.cache_file)
 
-        # Floyd-Warshall algorithm
-        size = len(self.indexes)
+    def tree(self, into):
+        # tree[v] is the next currency on the shortest path from v to into, -1 if unreachable
+        with self.next_hops_lock:
+            if into not in self.next_hops:
+                with metrics.registry.timer('pair_graph.tree.' + getattr(self.exchange, 'id', 'exchange')):
+                    tree = array('i', [-1]) * len(self.currencies)
+                    tree[into] = into
+                    queue = deque([into])
+                    while queue:
+                        v = queue.popleft()
+                        for u in self.neighbours[v]:
+                            if tree[u] == -1:
+                                tree[u] = v
+                                queue.append(u)
+                    self.next_hops[into] = tree
+                    if self.cache_file is not None:
+                        self.save_routes()
+            return self.next_hops[into]
 
-        for k in range(size):
-            for i in range(size):
-                for j in range(size):
-                    self.path[i][j] = self.shorter_path(self.path[i][k], self.path[k][j], self.path[i][j])
-        # convert table cash
-        self.convert_table = [[None for _ in self.indexes] for _ in self.indexes]
+    def path(self, from_, into):
+        tree = self.tree(into)
+        if tree[from_] == -1:
+            raise Exception("No conversion path from {} to {}".format(self.currencies[from_], self.currencies[into]))
+        result = [from_]
+        while result[-1] != into:
+            result.append(tree[result[-1]])
+        return result
+
+    def update_valuation(self, into='BTC'):
+        root = self.indexes[into]
+        tree = self.tree(root)
+        values = [None] * len(self.currencies)
+        values[root] = 1.0
+        for v in range(len(values)):
+            # walk up the tree until a valued currency, then fill the chain back
+            chain = []
+            u = v
+            while values[u] is None and tree[u] != -1:
+                chain.append(u)
+                u = tree[u]
+            if values[u] is None:
+                continue
+            for w in reversed(chain):
+                try:
+                    values[w] = self.convert_multiplier(w, tree[w]) * values[tree[w]]
+                except Exception:
+                    # rate unavailable, currency and the rest of its chain
+                    # stay unvalued like unreachable ones
+                    metrics.registry.count('valuation.errors')
+                    values[w] = float('nan')
+        self.valuation = array('d', (float('nan') if x is None else x for x in values))
+        self.valuation_currency = into
+
+    def valuate(self, currency, amounts, into='BTC'):
+        if self.valuation is None or self.valuation_currency != into:
+            self.update_valuation(into)
+        multiplier = self.valuation[self.indexes[currency]]
+        return [a * multiplier for a in amounts]
 
     def convert_currency(self, from_, into, value):
         if from_ == into:
             return value
-        path = self.path[self.indexes[from_]][self.indexes[into]]
+        path = self.path(self.indexes[from_], self.indexes[into])
         for i in range(len(path)-1):
             f = path[i]
             i = path[i+1]
@@ -53,43 +203,102 @@ class PairGraph:
         return value
 
     def convert_multiplier(self, from_, into):
-        cashed = self.convert_table[from_][into]
-        if cashed is not None:
-            return  cashed
-
-        if self.route[from_][into]:
+        if self.route[(from_, into)]:
             pair = self.currencies[from_] + "/" + self.currencies[into]
-            book = self.exchange.fetch_order_book(pair)
-            convert = (book['bids'][0][0] + book['asks'][0][0])/2
+            return self.rates.get(pair)
         else:
             pair = self.currencies[into] + "/" + self.currencies[from_]
-            book = self.exchange.fetch_order_book(pair)
-            convert = 2/(book['bids'][0][0] + book['asks'][0][0])
-
-        self.convert_table[from_][into] = convert
-        self.convert_table[into][from_] = 1/convert
-        return convert
-                    
-    @staticmethod
-    def shorter_path(left_add, right_add, comp):
-        if left_add is None or right_add is None:
-            return comp
-        elif comp is None:
-            assert left_add[-1] == right_add[0]
-            return left_add + right_add[1:]
-        elif len(comp) > len(left_add) + len(right_add):
-            assert left_add[-1] == right_add[0]
-            return left_add + right_add[1:]
+            return 1/self.rates.get(pair)
+
+
+class RateCache:
+    # mid prices of markets refreshed in bulk with fetch_tickers once ttl expires
+    def __init__(self, exchange, ttl=RATE_TTL, serve_stale=True):
+        self.exchange = exchange
+        self.ttl = ttl
+        self.serve_stale = serve_stale
+        self.rates = {}
+        self.updated = None
+        # symbol -> time of markets missing in bulk response, fetched one by one
+        self.fallback = {}
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.refresh_thread = None
+
+    def age(self, symbol=None):
+        updated = self.fallback.get(symbol, self.updated)
+        if updated is None:
+            return None
+        return time.time() - updated
+
+    def is_stale(self, symbol=None):
+        age = self.age(symbol)
+        return age is None or age > self.ttl
+
+    def get(self, symbol):
+        self.ensure_fresh()
+        rate = self.rates.get(symbol)
+        if rate is None or (symbol in self.fallback and self.is_stale(symbol)):
+            # market missing in bulk response
+            book = self.exchange.fetch_order_book(symbol)
+            rate = (book['bids'][0][0] + book['asks'][0][0])/2
+            with self.lock:
+                self.rates[symbol] = rate
+                self.fallback[symbol] = time.time()
+        return rate
+
+    def ensure_fresh(self):
+        if not self.is_stale():
+            return
+        if self.updated is not None and self.serve_stale:
+            with self.lock:
+                if self.refresh_thread is None or not self.refresh_thread.is_alive():
+                    self.refresh_thread = threading.Thread(target=self.refresh, daemon=True)
+                    self.refresh_thread.start()
         else:
-            return comp
-        
+            self.refresh()
+
+    def refresh(self):
+        with self.refresh_lock:
+            if self.updated is not None and not self.is_stale():
+                return
+            if self.exchange.has.get('fetchTickers'):
+                tickers = self.exchange.fetch_tickers()
+            else:
+                tickers = {s: self.exchange.fetch_ticker(s) for s in list(self.rates)}
+            self.update(tickers)
+
+    def update(self, tickers):
+        rates = {}
+        for symbol, ticker in tickers.items():
+            rate = mid_price(ticker)
+            if rate:
+                rates[symbol] = rate
+        with self.lock:
+            self.rates.update(rates)
+            for symbol in rates:
+                self.fallback.pop(symbol, None)
+            self.updated = time.time()
+
+
+def mid_price(ticker):
+    if ticker.get('bid') and ticker.get('ask'):
+        return (ticker['bid'] + ticker['ask'])/2
+    return ticker.get('last')
+
+
+def markets_hash(markets):
+    key = sorted((m['symbol'], m['base'], m['quote']) for m in markets)
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
 
 def all_currencies(markets):
     res = set()
     for m in markets:
         res.add(m['base'])
         res.add(m['quote'])
-    return list(res)
+    # sorted so cached routes keep the same currency indexes between runs
+    return sorted(res)
 
 if __name__ == '__main__':
     PairGraph(ccxt.exmo()).convert_currency("WAVES", "HBZ", 1)
@@ -0,0 +1,97 @@
+import random
+import time
+
+
+# 2018-01-01 UTC, trade k of every instance and process happens at the same
+# time, so restarted collectors see the same ids and timestamps
+EPOCH = 1514764800
+
+
+class FakeExchange:
+    # Offline stand-in for ccxt exchange with generated markets, books and
+    # trades. Trade k happens at epoch + k / trade_rate, so repeated
+    # fetch_trades calls return overlapping windows with stable ids.
+    def __init__(self, id='fake', currencies=50, extra_markets=1.0, depth=100,
+                 trade_rate=1.0, trades_window=100, latency=0.0, rate_limit=10,
+                 quote_volume=1000.0, seed=0, epoch=EPOCH):
+        self.id = id
+        self.rateLimit = rate_limit
+        self.has = {'fetchTickers': True}
+        self.depth = depth
+        self.trade_rate = trade_rate
+        self.trades_window = trades_window
+        self.latency = latency
+        self.quote_volume = quote_volume
+        self.epoch = epoch
+        rnd = random.Random(seed)
+        names = ['BTC'] + ['C{}'.format(i) for i in range(1, currencies)]
+        self.prices = {c: rnd.uniform(0.001, 10.0) for c in names}
+        self.prices['BTC'] = 1.0
+        # spanning tree keeps every currency convertible, then random extra markets
+        pairs = set()
+        for i in range(1, currencies):
+            pairs.add((names[i], names[rnd.randrange(0, min(i, 10))]))
+        for _ in range(int(extra_markets * currencies)):
+            a, b = rnd.sample(names, 2)
+            if (b, a) not in pairs:
+                pairs.add((a, b))
+        self.markets = [
+            {'symbol': '{}/{}'.format(base, quote), 'base': base, 'quote': quote}
+            for base, quote in sorted(pairs)
+        ]
+        self.symbols = {m['symbol']: m for m in self.markets}
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def mid(self, symbol):
+        market = self.symbols[symbol]
+        return self.prices[market['base']] / self.prices[market['quote']]
+
+    def fetch_markets(self):
+        self.wait()
+        return [dict(m) for m in self.markets]
+
+    def ticker(self, symbol):
+        mid = self.mid(symbol)
+        return {
+            'symbol': symbol,
+            'bid': mid * 0.995,
+            'ask': mid * 1.005,
+            'last': mid,
+            'bidVolume': 1.0,
+            'quoteVolume': self.quote_volume,
+        }
+
+    def fetch_ticker(self, symbol):
+        self.wait()
+        return self.ticker(symbol)
+
+    def fetch_tickers(self, symbols=None):
+        self.wait()
+        return {s: self.ticker(s) for s in (symbols or self.symbols)}
+
+    def fetch_order_book(self, symbol):
+        self.wait()
+        mid = self.mid(symbol)
+        step = mid * 0.001
+        return {
+            'asks': [[mid * 1.005 + i * step, 1.0 + i % 7] for i in range(self.depth)],
+            'bids': [[mid * 0.995 - i * step, 1.0 + i % 5] for i in range(self.depth)],
+        }
+
+    def fetch_trades(self, symbol):
+        self.wait()
+        mid = self.mid(symbol)
+        last = int((time.time() - self.epoch) * self.trade_rate)
+        trades = []
+        for k in range(max(0, last - self.trades_window), last):
+            trades.append({
+                'id': str(k),
+                'timestamp': int((self.epoch + k / self.trade_rate) * 1000),
+                'side': 'buy' if k % 2 else 'sell',
+                'price': mid,
+                'amount': 1.0 + k % 3,
+            })
+        return trades
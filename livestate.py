@@ -0,0 +1,156 @@
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from collections import namedtuple
+from os import path
+
+
+# Fixed size file mapped by collector (writer) and bot (readers):
+#   header  - HEADER_SIZE bytes, SEQ + HEADER
+#   slots   - SLOT_SIZE bytes per pair, SEQ + SLOT
+# Every record is guarded by its own sequence number (seqlock): writer makes
+# it odd before changing the record and even again after, readers retry
+# until they see the same even number before and after copying the record.
+MAGIC = b'CSLIVE1\n'
+SEQ = struct.Struct('<Q')
+HEADER = struct.Struct('<8sdqqq')
+HEADER_SIZE = 64
+SLOT = struct.Struct('<16s32sdddddq32sdd')
+SLOT_SIZE = 160
+SLOTS = 1024
+PREFIX = 'live'
+SUFFIX = '.state'
+# weight of the latest poll in trade rate average
+RATE_SMOOTHING = 0.3
+READ_RETRIES = 1000
+
+Heartbeat = namedtuple('Heartbeat', 'time pid iterations pairs')
+PairState = namedtuple('PairState', 'exchange pair updated ask ask_amount bid bid_amount '
+                                    'trade_timestamp trade_id trade_rate btc_rate')
+
+
+def file_name(worker=None):
+    if worker is None:
+        return PREFIX + SUFFIX
+    return '{}.{}{}'.format(PREFIX, worker, SUFFIX)
+
+
+def text(value, size):
+    return value.encode('utf-8')[:size]
+
+
+class LiveState:
+    # Writer side, one per process. Thread safe, pairs take slots in order of
+    # their first update and keep them until the file is recreated.
+    def __init__(self, file_path, slots=SLOTS):
+        self.file_path = file_path
+        self.capacity = slots
+        self.slots = {}
+        self.rates = {}
+        self.iterations = 0
+        self.lock = threading.Lock()
+        # readers keep seeing the old file until the new one is complete
+        tmp = file_path + '.tmp'
+        with open(tmp, 'w+b') as f:
+            f.truncate(HEADER_SIZE + slots * SLOT_SIZE)
+            self.map = mmap.mmap(f.fileno(), 0)
+        self.beat(0)
+        os.replace(tmp, file_path)
+
+    def publish(self, offset, record, *values):
+        seq = SEQ.unpack_from(self.map, offset)[0] + 1
+        SEQ.pack_into(self.map, offset, seq)
+        record.pack_into(self.map, offset + SEQ.size, *values)
+        SEQ.pack_into(self.map, offset, seq + 1)
+
+    def beat(self, iterations=None):
+        with self.lock:
+            if iterations is not None:
+                self.iterations = iterations
+            self.publish(0, HEADER, MAGIC, time.time(), os.getpid(), self.iterations, len(self.slots))
+
+    def update(self, exchange_name, pair, order_book, cursor, new_trades, btc_rate):
+        key = (exchange_name, pair)
+        now = time.time()
+        asks, bids = order_book['asks'], order_book['bids']
+        ask, ask_amount = asks[0][:2] if asks else (math.nan, 0.0)
+        bid, bid_amount = bids[0][:2] if bids else (math.nan, 0.0)
+        timestamp, trade_id = cursor if cursor is not None else (0, '')
+        with self.lock:
+            index = self.slots.get(key)
+            added = index is None
+            if added:
+                if len(self.slots) >= self.capacity:
+                    return
+                index = self.slots[key] = len(self.slots)
+            last, rate = self.rates.get(key, (None, 0.0))
+            if last is not None and now > last:
+                rate = RATE_SMOOTHING * new_trades / (now - last) + (1 - RATE_SMOOTHING) * rate
+            self.rates[key] = (now, rate)
+            self.publish(
+                HEADER_SIZE + index * SLOT_SIZE, SLOT,
+                text(exchange_name, 16), text(pair, 32), now,
+                ask, ask_amount, bid, bid_amount,
+                timestamp, text(trade_id, 32), rate, btc_rate,
+            )
+        if added:
+            # readers learn about new slot from header
+            self.beat()
+
+    def close(self):
+        with self.lock:
+            self.map.close()
+
+
+def read_record(buffer, offset, record):
+    for _ in range(READ_RETRIES):
+        seq = SEQ.unpack_from(buffer, offset)[0]
+        if seq % 2:
+            time.sleep(0)
+            continue
+        values = record.unpack_from(buffer, offset + SEQ.size)
+        if SEQ.unpack_from(buffer, offset)[0] == seq:
+            return values
+    # writer died in the middle of the record
+    return None
+
+
+def read(file_path):
+    # (Heartbeat, [PairState]) of live state file, never blocks the writer
+    with open(file_path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        header = read_record(buffer, 0, HEADER)
+        if header is None or header[0] != MAGIC:
+            raise Exception("Not a live state file: {}".format(file_path))
+        heartbeat = Heartbeat(*header[1:])
+        capacity = (len(buffer) - HEADER_SIZE) // SLOT_SIZE
+        pairs = []
+        for i in range(min(heartbeat.pairs, capacity)):
+            values = read_record(buffer, HEADER_SIZE + i * SLOT_SIZE, SLOT)
+            if values is None:
+                continue
+            values = list(values)
+            for j in (0, 1, 8):
+                values[j] = values[j].rstrip(b'\0').decode('utf-8', 'replace')
+            pairs.append(PairState(*values))
+        return heartbeat, pairs
+    finally:
+        buffer.close()
+
+
+def read_all(directory):
+    # {file name: (Heartbeat, [PairState])} of every collector process
+    result = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(PREFIX) and name.endswith(SUFFIX):
+            try:
+                result[name] = read(path.join(directory, name))
+            except FileNotFoundError:
+                # replaced by new collector meanwhile
+                continue
+    return result
@@ -0,0 +1,99 @@
+import numpy as np
+
+import archive
+
+
+CHUNK_ROWS = 100000
+
+# columns after the log time, strings keep leading space from ', ' separator
+SPREAD_COLUMNS = (1, 2)
+SPREAD_DTYPE = np.dtype([('ask', 'f8'), ('bid', 'f8')])
+TRADE_COLUMNS = (1, 3, 4, 5, 6, 7)
+RAW_TRADE_DTYPE = np.dtype([
+    ('timestamp', 'i8'), ('side', 'U5'), ('price', 'f8'),
+    ('amount', 'f8'), ('break', 'U12'), ('amount_btc', 'f8'),
+])
+TRADE_DTYPE = np.dtype([
+    ('timestamp', 'i8'), ('side', 'U4'), ('price', 'f8'),
+    ('amount', 'f8'), ('new_session', '?'), ('amount_btc', 'f8'),
+])
+
+
+def read_chunks(file_path, offset=0, chunk_rows=CHUNK_ROWS):
+    # (lines, end offset) of complete lines after offset, partial last line is left out
+    try:
+        f = archive.open_file(file_path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        lines = []
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            lines.append(line.decode('utf-8'))
+            if len(lines) >= chunk_rows:
+                yield lines, offset
+                lines = []
+        if lines:
+            yield lines, offset
+
+
+def parse_spread(lines):
+    return np.loadtxt(lines, delimiter=',', usecols=SPREAD_COLUMNS, dtype=SPREAD_DTYPE, ndmin=1)
+
+
+def parse_trades(lines):
+    raw = np.loadtxt(lines, delimiter=',', usecols=TRADE_COLUMNS, dtype=RAW_TRADE_DTYPE, ndmin=1)
+    trades = np.empty(len(raw), dtype=TRADE_DTYPE)
+    for name in ('timestamp', 'price', 'amount', 'amount_btc'):
+        trades[name] = raw[name]
+    trades['side'] = np.char.strip(raw['side'])
+    trades['new_session'] = np.char.strip(raw['break']) == 'break=True'
+    return trades
+
+
+def relative_spread(spread):
+    return (spread['ask'] - spread['bid']) / spread['ask']
+
+
+def add_spread(aggregate, spread):
+    aggregate.spread_sum += float(relative_spread(spread).sum())
+    aggregate.spread_count += len(spread)
+
+
+def add_trades(aggregate, trades):
+    # same as PairAggregate.add_trade for every row, sessions may continue from
+    # rows added earlier
+    if len(trades) == 0:
+        return
+    timestamps = trades['timestamp']
+    new_session = trades['new_session'].copy()
+    if aggregate.session_start is None:
+        new_session[0] = True
+    starts = np.flatnonzero(new_session)
+    if len(starts) == 0:
+        aggregate.session_end = int(timestamps[-1])
+    else:
+        if aggregate.session_start is not None:
+            end = int(timestamps[starts[0] - 1]) if starts[0] > 0 else aggregate.session_end
+            aggregate.total_time += (end - aggregate.session_start) / 1000
+        ends = np.append(starts[1:] - 1, len(timestamps) - 1)
+        aggregate.total_time += float((timestamps[ends[:-1]] - timestamps[starts[:-1]]).sum()) / 1000
+        aggregate.session_start = int(timestamps[starts[-1]])
+        aggregate.session_end = int(timestamps[-1])
+    aggregate.trade_count += len(trades)
+    aggregate.volume_btc += float(trades['amount_btc'].sum())
+
+
+def catch_up(store, exchange_name, pair, file_path):
+    # vectorized AggregateStore.catch_up
+    aggregate = store.get(exchange_name, pair)
+    for lines, offset in read_chunks(file_path(('spread', exchange_name, pair)), aggregate.offsets['spread']):
+        add_spread(aggregate, parse_spread(lines))
+        aggregate.offsets['spread'] = offset
+    for lines, offset in read_chunks(file_path(('trades', exchange_name, pair)), aggregate.offsets['trades']):
+        add_trades(aggregate, parse_trades(lines))
+        aggregate.offsets['trades'] = offset
+    return aggregate
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+
+class Histogram:
+    # all time count and sum plus rolling window of recent samples for percentiles
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def snapshot(self):
+        recent = sorted(self.samples)
+        if not recent:
+            return {'count': self.count}
+        def percentile(p):
+            return recent[min(len(recent) - 1, int(p * len(recent)))]
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': sum(recent) / len(recent),
+            'p50': percentile(0.5),
+            'p90': percentile(0.9),
+            'p99': percentile(0.99),
+            'max': recent[-1],
+        }
+
+
+class Metrics:
+    def __init__(self, window=1000):
+        self.window = window
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.window)
+            histogram.add(value)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time.time(),
+                'histograms': {k: h.snapshot() for k, h in self.histograms.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    def export(self, file_path):
+        tmp = file_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, file_path)
+
+
+# process wide registry used by collector, exchange and writer
+registry = Metrics()
+
+
+def load(file_path):
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+
+def merge(snapshots):
+    # one snapshot of several processes, percentiles of merged histograms
+    # are the worst of the processes
+    result = {'time': 0, 'histograms': {}, 'counters': {}, 'gauges': {}}
+    for snapshot in snapshots:
+        result['time'] = max(result['time'], snapshot['time'])
+        for name, value in snapshot['counters'].items():
+            result['counters'][name] = result['counters'].get(name, 0) + value
+        result['gauges'].update(snapshot['gauges'])
+        for name, h in snapshot['histograms'].items():
+            current = result['histograms'].get(name)
+            if current is None or 'mean' not in current:
+                result['histograms'][name] = dict(h, count=h['count'] + (current or {}).get('count', 0))
+            elif 'mean' in h:
+                count = current['count'] + h['count']
+                merged = {k: max(current[k], h[k]) for k in ('p50', 'p90', 'p99', 'max')}
+                merged['count'] = count
+                merged['total'] = current['total'] + h['total']
+                merged['mean'] = merged['total'] / count
+                result['histograms'][name] = merged
+            else:
+                current['count'] += h['count']
+    return result
+
+
+def load_all(directory, prefix='metrics'):
+    # merged <prefix>.json of collector and <prefix>.<worker>.json of shard workers
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        if name.startswith(prefix + '.') and name.endswith('.json'):
+            try:
+                snapshots.append(load(os.path.join(directory, name)))
+            except FileNotFoundError:
+                continue
+    return merge(snapshots)
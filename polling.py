@@ -0,0 +1,62 @@
+import threading
+import time
+
+
+# fetch_trades and fetch_order_book
+REQUESTS_PER_POLL = 2
+
+
+class PollPolicy:
+    # Per pair poll interval adapted to trade activity. When most of a
+    # fetch_trades response is new the window probably overflowed and trades
+    # were lost, so the pair is polled more often. When almost nothing is new
+    # polling is slowed down.
+    def __init__(self, min_interval, max_interval, initial=None,
+                 high=0.8, low=0.2, shrink=0.5, grow=1.5):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial = initial if initial is not None else min_interval
+        self.high = high
+        self.low = low
+        self.shrink = shrink
+        self.grow = grow
+        self.intervals = {}
+        self.due = {}
+        self.lock = threading.Lock()
+
+    def interval(self, key):
+        return self.intervals.get(key, self.initial)
+
+    def due_pairs(self, pairs, request_rates, now=None):
+        # due pairs, most overdue first, each exchange limited to the number of
+        # polls its request rate allows per min_interval
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            due = [p for p in pairs if self.due.get(p, 0) <= now]
+            due.sort(key=lambda p: self.due.get(p, 0))
+        budgets = {
+            e: max(1, int(rate * self.min_interval / REQUESTS_PER_POLL))
+            for e, rate in request_rates.items()
+        }
+        result = []
+        for exchange_name, pair in due:
+            if budgets.get(exchange_name, 1) > 0:
+                budgets[exchange_name] = budgets.get(exchange_name, 1) - 1
+                result.append((exchange_name, pair))
+        return result
+
+    def observe(self, key, new_count, total_count, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            interval = self.interval(key)
+            fraction = new_count / total_count if total_count else 0.0
+            if total_count and fraction >= self.high:
+                interval *= self.shrink
+            elif fraction <= self.low:
+                interval *= self.grow
+            interval = min(self.max_interval, max(self.min_interval, interval))
+            self.intervals[key] = interval
+            self.due[key] = now + interval
+            return interval
@@ -0,0 +1,138 @@
+import heapq
+import itertools
+import os
+import time
+
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from os import path
+
+import archive
+import bookstore
+import timeindex
+from collector import generic_file_path
+
+
+# time is the unix time the row was logged by collector, events are merged on it
+Trade = namedtuple('Trade', 'time exchange pair timestamp id side price amount new_session amount_btc')
+Spread = namedtuple('Spread', 'time exchange pair ask bid')
+OrderBook = namedtuple('OrderBook', 'time exchange pair iteration asks bids')
+
+KINDS = ('trades', 'spread', 'order_book')
+
+
+def day_roots(root, start=None, end=None):
+    # day directories (or their archives) under root, limited to dates of [start, end]
+    days = set()
+    for name in os.listdir(root):
+        if name.endswith(archive.SUFFIX):
+            name = name[:-len(archive.SUFFIX)]
+        try:
+            day = date.fromisoformat(name)
+        except ValueError:
+            continue
+        if start is not None and day < datetime.fromtimestamp(timeindex.to_timestamp(start)).date() - timedelta(days=1):
+            continue
+        if end is not None and day > datetime.fromtimestamp(timeindex.to_timestamp(end)).date():
+            continue
+        days.add(name)
+    return [path.join(root, name) for name in sorted(days)]
+
+
+def read_trades(day_root, exchange_name, pair, start=None, end=None):
+    file_path = generic_file_path(day_root, ('trades', exchange_name, pair))
+    for t, line in timeindex.read_rows(file_path, start, end):
+        _, timestamp, trade_id, side, price, amount, br, amount_btc = [x.strip() for x in line.split(',')]
+        yield Trade(t, exchange_name, pair, int(timestamp), trade_id, side, float(price), float(amount),
+                    br == 'break=True', float(amount_btc))
+
+
+def read_spread(day_root, exchange_name, pair, start=None, end=None):
+    file_path = generic_file_path(day_root, ('spread', exchange_name, pair))
+    for t, line in timeindex.read_rows(file_path, start, end):
+        _, ask, bid = [x.strip() for x in line.split(',')]
+        yield Spread(t, exchange_name, pair, float(ask), float(bid))
+
+
+def read_order_books(day_root, exchange_name, pair, start=None, end=None):
+    # books from whichever storage the day was collected with
+    book_id = ('order_book', exchange_name, pair)
+    base_path = generic_file_path(day_root, book_id, ext="")
+    if archive.file_exists(base_path + '.delta.head'):
+        history = bookstore.load_delta_books(base_path)
+    elif archive.file_exists(base_path + '.head'):
+        history = bookstore.load_books(base_path)
+    else:
+        yield from read_csv_books(generic_file_path(day_root, book_id), exchange_name, pair, start, end)
+        return
+    times = history.headers['time']
+    first = 0
+    if start is not None:
+        first = int(times.searchsorted(timeindex.to_timestamp(start), 'left'))
+    end = timeindex.to_timestamp(end)
+    for i, asks, bids in history.books(first):
+        t = float(times[i])
+        if end is not None and t > end:
+            break
+        yield OrderBook(t, exchange_name, pair, int(history.headers['iteration'][i]), asks, bids)
+
+
+def read_csv_books(file_path, exchange_name, pair, start=None, end=None):
+    # rows of one snapshot share log time and iteration
+    book = None
+    for t, line in timeindex.read_rows(file_path, start, end):
+        _, iteration, side, price, amount = [x.strip() for x in line.split(',')]
+        iteration = int(iteration)
+        if book is None or book.time != t or book.iteration != iteration:
+            if book is not None:
+                yield book
+            book = OrderBook(t, exchange_name, pair, iteration, [], [])
+        levels = book.asks if side == 'ask' else book.bids
+        levels.append([float(price), float(amount)])
+    if book is not None:
+        yield book
+
+
+READERS = {
+    'trades': read_trades,
+    'spread': read_spread,
+    'order_book': read_order_books,
+}
+
+
+def replay(root, pairs, start=None, end=None, kinds=KINDS, speed=None, days=None):
+    # Events of (exchange, pair) list from day directories of root in log time
+    # order. Files are read lazily and only one event per file is kept in memory,
+    # so memory does not grow with the replayed span. With speed set, events
+    # are delivered in real time sped up `speed` times.
+    if days is None:
+        days = day_roots(root, start, end)
+    streams = [
+        stream(days, kind, exchange_name, pair, start, end)
+        for exchange_name, pair in pairs
+        for kind in kinds
+    ]
+    events = heapq.merge(*streams, key=lambda event: event.time)
+    if speed:
+        events = paced(events, speed)
+    return events
+
+
+def stream(days, kind, exchange_name, pair, start=None, end=None):
+    # days do not overlap, so events of one file kind are a plain chain
+    reader = READERS[kind]
+    return itertools.chain.from_iterable(
+        reader(day_root, exchange_name, pair, start, end) for day_root in days
+    )
+
+
+def paced(events, speed):
+    origin = None
+    for event in events:
+        if origin is None:
+            origin = (event.time, time.monotonic())
+        else:
+            delay = origin[1] + (event.time - origin[0]) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield event
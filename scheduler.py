@@ -0,0 +1,75 @@
+import threading
+import time
+import traceback
+
+from collections import deque
+
+
+print_native = print
+def print(*args):
+    try:
+        print_native(*args)
+    except OSError as e:
+        pass
+
+
+class Scheduler:
+    # Calls function on fixed deadlines start + k * interval, sleeping on an
+    # event in between. Runs never overlap: ticks missed while a run overruns
+    # are skipped and the next run happens on the following deadline. Failed
+    # run is counted and passed to on_error(traceback text), scheduling goes on.
+    def __init__(self, interval, function, *args, history=100, **kwargs):
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.stopped = threading.Event()
+        self.on_error = None
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.lateness = deque(maxlen=history)
+        self.durations = deque(maxlen=history)
+
+    def run(self, immediately=True):
+        # blocks until stop() is called
+        deadline = time.monotonic()
+        if not immediately:
+            deadline += self.interval
+        while not self.stopped.wait(max(0, deadline - time.monotonic())):
+            start = time.monotonic()
+            self.lateness.append(start - deadline)
+            try:
+                self.function(*self.args, **self.kwargs)
+            except Exception:
+                self.errors += 1
+                error = traceback.format_exc()
+                if self.on_error is not None:
+                    self.on_error(error)
+                print(error)
+            finally:
+                end = time.monotonic()
+                self.durations.append(end - start)
+                self.runs += 1
+            deadline += self.interval
+            if deadline <= end:
+                missed = int((end - deadline) // self.interval) + 1
+                self.skipped += missed
+                deadline += missed * self.interval
+
+    def stop(self):
+        self.stopped.set()
+
+    def stats(self):
+        def summary(values):
+            if not values:
+                return None
+            return {'last': values[-1], 'mean': sum(values) / len(values), 'max': max(values)}
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'lateness': summary(self.lateness),
+            'duration': summary(self.durations),
+        }
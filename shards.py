@@ -0,0 +1,218 @@
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+
+from multiprocessing.connection import wait
+from os import path
+
+import collector
+import exchange
+import livestate
+import metrics
+from polling import REQUESTS_PER_POLL
+
+
+print_native = print
+def print(*args):
+    try:
+        print_native(*args)
+    except OSError as e:
+        pass
+
+
+# Collector class attributes copied into worker processes
+SETTINGS = ('WORKERS', 'BOOK_STORAGE', 'ADAPTIVE_POLLING', 'POLL_INTERVAL_BOUNDS')
+# seconds of worker time expected per collected trade
+TRADE_COST = 0.0005
+
+
+def partition(pairs, rates, count, loads=None):
+    # greedy longest-first split of (exchange, pair) list into count parts of
+    # similar expected cycle time, a pair costs its requests at exchange rate
+    # limit plus its load
+    loads = loads or {}
+    def weight(key):
+        return REQUESTS_PER_POLL / rates[key[0]] + loads.get(key, 0.0)
+    parts = [[] for _ in range(count)]
+    totals = [0.0] * count
+    for key in sorted(pairs, key=weight, reverse=True):
+        i = totals.index(min(totals))
+        parts[i].append(key)
+        totals[i] += weight(key)
+    return parts
+
+
+def rate_shares(parts, rates):
+    # exchange rate limit is split between workers by their number of its pairs
+    counts = {}
+    for part in parts:
+        for exchange_name, _ in part:
+            counts[exchange_name] = counts.get(exchange_name, 0) + 1
+    shares = []
+    for part in parts:
+        share = {}
+        for exchange_name, _ in part:
+            share[exchange_name] = share.get(exchange_name, 0.0) + rates[exchange_name] / counts[exchange_name]
+        shares.append(share)
+    return shares
+
+
+def metrics_file_name(number):
+    return "metrics.{}.json".format(number)
+
+
+def run_worker(root, number, pairs, cursors, iterations, settings, rates, verbose, conn):
+    # started with spawn, so nothing (open files, writer buffers, threads) is
+    # inherited from coordinator
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in SETTINGS:
+        setattr(collector.Collector, name, settings[name])
+    exchange.REQUESTS_PER_SECOND.update(rates)
+    collector.cmd_args.verbose = verbose
+    metrics_file = path.join(path.dirname(path.normpath(root)), "collector_manager", metrics_file_name(number))
+    c = collector.Collector(root, pairs=pairs, cursors=cursors, worker=number)
+    c.iterations = iterations
+    try:
+        while True:
+            command = conn.recv()
+            if command == 'stop':
+                break
+            try:
+                c.collect()
+                conn.send(('done', c.save_state()))
+            except Exception:
+                conn.send(('error', traceback.format_exc()))
+            metrics.registry.export(metrics_file)
+    finally:
+        c.close()
+
+
+class Shard:
+    def __init__(self, number, pairs, rates):
+        self.number = number
+        self.pairs = pairs
+        self.rates = rates
+        self.process = None
+        self.conn = None
+
+
+class ShardPool:
+    # Coordinator side of sharded collection. Pairs of the manager collector
+    # are split between worker processes, every worker writes files of its own
+    # pairs only. Workers collect when told to and send back their state,
+    # cursors are merged into the manager collector. Dead or stuck workers
+    # are restarted.
+    def __init__(self, processes, settings, verbose=False, timeout=600):
+        self.processes = processes
+        self.settings = settings
+        self.verbose = verbose
+        self.timeout = timeout
+        self.context = multiprocessing.get_context('spawn')
+        self.shards = []
+        self.layout = None
+        self.cache_dir = None
+
+    def assign(self, c):
+        # restart workers when day or pair selection changed
+        layout = (c.path, tuple(c.pairs))
+        if layout == self.layout:
+            return
+        self.stop()
+        rates = {e: exchange.shared_api(e).bucket.rate for e, _ in c.pairs}
+        cycles = max(1, c.iterations)
+        loads = {key: TRADE_COST * a.trade_count / cycles for key, a in c.aggregates.pairs.items()}
+        parts = partition(c.pairs, rates, self.processes, loads)
+        self.shards = [
+            Shard(i, part, share)
+            for i, (part, share) in enumerate(zip(parts, rate_shares(parts, rates)))
+            if part
+        ]
+        self.layout = layout
+        self.cache_dir = c.cache_dir
+        for shard in self.shards:
+            self.start(shard, c)
+
+    def start(self, shard, c):
+        cursors = {p: c.cursors[p] for p in shard.pairs if p in c.cursors}
+        parent, child = self.context.Pipe()
+        args = (c.path, shard.number, shard.pairs, cursors or None, c.iterations,
+                self.settings, shard.rates, self.verbose, child)
+        shard.process = self.context.Process(target=run_worker, args=args, daemon=True)
+        shard.process.start()
+        child.close()
+        shard.conn = parent
+        print("Started worker {} pid={} pairs={}".format(shard.number, shard.process.pid, len(shard.pairs)))
+
+    def restart(self, shard, c):
+        print("Restarting worker {}".format(shard.number))
+        metrics.registry.count('shards.restarts')
+        self.kill(shard)
+        self.start(shard, c)
+
+    def collect(self, c):
+        self.assign(c)
+        pending = {}
+        for shard in self.shards:
+            if not shard.process.is_alive():
+                self.restart(shard, c)
+            try:
+                shard.conn.send('collect')
+            except OSError:
+                # died right after the check, collected next cycle
+                self.restart(shard, c)
+                continue
+            pending[shard.conn] = shard
+        deadline = time.monotonic() + self.timeout
+        while pending:
+            ready = wait(list(pending), max(0, deadline - time.monotonic()))
+            if not ready:
+                break
+            for conn in ready:
+                shard = pending.pop(conn)
+                try:
+                    status, data = conn.recv()
+                except (EOFError, OSError):
+                    print("Worker {} died".format(shard.number))
+                    self.restart(shard, c)
+                    continue
+                if status == 'done':
+                    c.cursors.update(collector.state_cursors(data) or {})
+                    c.iterations = max(c.iterations, data['iterations'])
+                else:
+                    print("Worker {} failed:\n{}".format(shard.number, data))
+        for shard in pending.values():
+            print("Worker {} timed out".format(shard.number))
+            self.restart(shard, c)
+        metrics.registry.gauge('shards', {s.number: len(s.pairs) for s in self.shards})
+
+    def kill(self, shard):
+        shard.process.terminate()
+        shard.process.join()
+        shard.conn.close()
+
+    def stop(self):
+        # workers flush and close their files before exit
+        for shard in self.shards:
+            try:
+                shard.conn.send('stop')
+            except OSError:
+                pass
+        for shard in self.shards:
+            shard.process.join(30)
+            if shard.process.is_alive():
+                self.kill(shard)
+            else:
+                shard.conn.close()
+            # stopped worker would look stale to heartbeat check and its
+            # metrics would be summed into stats forever, killed one may also
+            # leave its unfinished export
+            metrics_file = metrics_file_name(shard.number)
+            for name in (livestate.file_name(shard.number), metrics_file, metrics_file + '.tmp'):
+                try:
+                    os.remove(path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+        self.shards = []
+        self.layout = None
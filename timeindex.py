@@ -0,0 +1,67 @@
+import struct
+
+from bisect import bisect_right
+from datetime import datetime
+
+import archive
+
+
+# <file>.idx holds (row time, byte offset of row) for every INDEX_EVERY-th row
+SUFFIX = '.idx'
+ENTRY = struct.Struct('<dq')
+INDEX_EVERY = 256
+
+
+def read_index(file_path):
+    try:
+        with archive.open_file(file_path + SUFFIX, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return [], []
+    times = []
+    offsets = []
+    for i in range(0, len(data) - len(data) % ENTRY.size, ENTRY.size):
+        t, offset = ENTRY.unpack_from(data, i)
+        times.append(t)
+        offsets.append(offset)
+    return times, offsets
+
+
+def to_timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return value
+
+
+def read_rows(file_path, start=None, end=None):
+    # (log time, row) of csv file with log time in [start, end], starts reading
+    # from the last indexed row before start instead of the top of the file
+    start = to_timestamp(start)
+    end = to_timestamp(end)
+    offset = 0
+    if start is not None:
+        times, offsets = read_index(file_path)
+        i = bisect_right(times, start) - 1
+        if i >= 0:
+            offset = offsets[i]
+    try:
+        f = archive.open_file(file_path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            line = line.decode('utf-8')
+            t = datetime.fromisoformat(line[:line.index(',')]).timestamp()
+            if start is not None and t < start:
+                continue
+            if end is not None and t > end:
+                break
+            yield t, line
+
+
+def read_range(file_path, start=None, end=None):
+    for _, line in read_rows(file_path, start, end):
+        yield line
@@ -0,0 +1,109 @@
+import os
+import resource
+import threading
+import time
+
+from collections import OrderedDict
+
+import metrics
+import timeindex
+
+
+# upper bound of open append handles when derived from descriptor limit
+MAX_OPEN = 4096
+
+
+def default_max_open():
+    # half of the descriptor limit, the rest is left to sockets and readers
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return MAX_OPEN
+    return max(16, min(MAX_OPEN, soft // 2))
+
+
+class BufferedWriter:
+    # Collects text rows (or binary records) in memory and appends them to
+    # their files in batches. Open append handles are kept in LRU order so hot
+    # files are not reopened on every flush. Rows written with a time key get
+    # sparse timeindex entries every index_every rows. Files written since the
+    # last sync are fsynced when their handle is evicted or on flush(sync=True).
+    def __init__(self, max_open=None, max_rows=5000, max_delay=30, index_every=timeindex.INDEX_EVERY):
+        self.max_open = max_open or default_max_open()
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.index_every = index_every
+        self.handles = OrderedDict()
+        self.dirty = set()
+        self.buffers = {}
+        self.sizes = {}
+        self.unindexed = {}
+        self.rows = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.RLock()
+
+    def write(self, file_path, line, key=None):
+        if isinstance(line, str):
+            line = line.encode('utf-8')
+        with self.lock:
+            offset = self.size(file_path)
+            if key is not None:
+                rows = self.unindexed.get(file_path)
+                if rows is None or rows >= self.index_every:
+                    entry = timeindex.ENTRY.pack(key, offset)
+                    self.buffers.setdefault(file_path + timeindex.SUFFIX, []).append(entry)
+                    rows = 0
+                self.unindexed[file_path] = rows + 1
+            self.buffers.setdefault(file_path, []).append(line)
+            self.sizes[file_path] = offset + len(line)
+            self.rows += 1
+            if self.rows >= self.max_rows or time.monotonic() - self.last_flush >= self.max_delay:
+                self.flush()
+
+    def flush(self, sync=False):
+        with self.lock, metrics.registry.timer('writer.flush'):
+            for file_path, lines in self.buffers.items():
+                f = self.handle(file_path)
+                data = b''.join(lines)
+                f.write(data)
+                f.flush()
+                self.dirty.add(file_path)
+                name = os.path.basename(file_path)
+                metrics.registry.count('rows.' + name, len(lines))
+                metrics.registry.count('bytes.' + name, len(data))
+            if sync:
+                for file_path in self.dirty:
+                    os.fsync(self.handles[file_path].fileno())
+                self.dirty.clear()
+            self.buffers = {}
+            self.rows = 0
+            self.last_flush = time.monotonic()
+
+    def size(self, file_path):
+        # file size including rows still buffered
+        if file_path not in self.sizes:
+            try:
+                self.sizes[file_path] = os.path.getsize(file_path)
+            except FileNotFoundError:
+                self.sizes[file_path] = 0
+        return self.sizes[file_path]
+
+    def handle(self, file_path):
+        f = self.handles.pop(file_path, None)
+        if f is None:
+            if len(self.handles) >= self.max_open:
+                oldest_path, oldest = self.handles.popitem(last=False)
+                if oldest_path in self.dirty:
+                    os.fsync(oldest.fileno())
+                    self.dirty.discard(oldest_path)
+                metrics.registry.count('writer.evictions')
+                oldest.close()
+            f = open(file_path, 'ab')
+        self.handles[file_path] = f
+        return f
+
+    def close(self):
+        with self.lock:
+            self.flush(sync=True)
+            for f in self.handles.values():
+                f.close()
+            self.handles.clear()